@@ -4,11 +4,25 @@ import gitdata
 
 
 class Application:
-    def __init__(self, menu_width, data_dir='Temp_session_data/', token=None):
+    # Caches and working files in the session folder that are left out of exports
+    export_ignore_patterns = ('http_cache', 'sync', 'checkpoints', 'text', 'users_cache.json*')
+
+    def __init__(self, menu_width, data_dir='Temp_session_data/', token=None, tokens=None, reserve=0, max_wait=None,
+                 max_repos=4):
         import shutil
         # Store specified menu width
         self.menu_width = menu_width
 
+        # Requests per token that are never used, and the longest wait for rate limits before giving up
+        self.reserve = reserve
+        self.max_wait = max_wait
+
+        # Repositories downloaded at the same time in batch mode, and the threads each one uses for pull request
+        # details and list pages. They all share one client, whose connection pool is sized to fit them
+        self.max_repos = max_repos
+        self.max_workers = 8
+        self.max_page_workers = 4
+
         # Initialize an empty list to store repo data
         self.repos = list()
 
@@ -24,6 +38,12 @@ class Application:
         self.repo_analysis_menu = RepoAnalysisMenu(parent_app=self)
         self.export_data_menu = ExportDataMenu(parent_app=self)
         self.input_token_menu = InputTokenMenu(parent_app=self)
+        self.load_saved_repos_menu = LoadSavedReposMenu(parent_app=self)
+        self.crawl_owner_menu = CrawlOwnerMenu(parent_app=self)
+        self.download_jobs_menu = DownloadJobsMenu(parent_app=self)
+
+        # Repositories are downloaded in the background, so the menus stay usable while they are
+        self.download_queue = DownloadQueue(parent_app=self, max_workers=2)
 
         # Create empty directories to store data
         self.data_dir = data_dir
@@ -48,38 +68,178 @@ class Application:
         else:
             shutil.rmtree(self.figures_dir)
             os.mkdir(self.figures_dir)
-
-        # Initialize token
-        if token is not None:
-            # If token parameter is used, create a file to store the token
-            self._token = token
-            with open('mytoken.txt', 'w') as f:
-                f.write(token)
+        # Pull request bodies are kept compressed on disk for the session and only read when they are needed
+        self.text_dir = data_dir + 'text/'
+        self.text_mode = 'sidecar'
+        if not os.path.exists(self.text_dir):
+            os.mkdir(self.text_dir)
+        else:
+            shutil.rmtree(self.text_dir)
+            os.mkdir(self.text_dir)
+
+        # Responses are cached outside the session folders so later sessions can revalidate them cheaply
+        self.http_cache = gitdata.ResponseCache(cache_dir=self.data_dir + 'http_cache/')
+        # The last sync of each repository is kept too, so downloading it again only fetches what changed
+        self.sync_dir = self.data_dir + 'sync/'
+        # Unfinished downloads are checkpointed here, asking for the same repository again resumes them
+        self.checkpoint_dir = self.data_dir + 'checkpoints/'
+        # Every downloaded repository is saved here, so it can be loaded again later without the network
+        self.store = gitdata.SessionStore(db_path=self.data_dir + 'session.db')
+        # Contributor profiles are shared by every repository and kept between sessions, so each one is downloaded
+        # at most once a week
+        self.user_cache = gitdata.ContributorCache(ttl_seconds=7 * 24 * 60 * 60, max_size=100000,
+                                                   cache_path=self.data_dir + 'users_cache.json')
+
+        # Initialize tokens. Several tokens can be used together, each request goes to the one with the most budget
+        tokens = list(tokens or list())
+        if token is not None and token not in tokens:
+            tokens.insert(0, token)
+
+        if len(tokens) > 0:
+            # If token parameters are used, create a file to store the tokens, one per line
+            self._tokens = tokens
+            self.save_tokens()
 
         elif os.path.exists('mytoken.txt'):
-            # Otherwise, try to use existing token from file
-            try:
-                with open('mytoken.txt') as f:
-                    token = f.read()
-                # Test the token to see if the credentials are good
-                gitdata.get_github_api_request('https://api.github.com/user', token=token)
-                # If no exception is generated, move on
-                self._token = token
-            except:
-                # If credentials don't work, delete the token file and prompt user input later
+            # Otherwise, try to use existing tokens from file
+            with open('mytoken.txt') as f:
+                saved_tokens = [line.strip() for line in f if line.strip() != '']
+
+            # Test each token to see if the credentials are good and only keep the ones that work
+            self._tokens = list()
+            for saved_token in saved_tokens:
+                try:
+                    self.validate_token(saved_token)
+                    self._tokens.append(saved_token)
+                except:
+                    pass
+
+            if len(self._tokens) == 0:
+                # If no credentials work, delete the token file and prompt user input later
                 try:
                     os.remove('mytoken.txt')
                 except:
                     print('WARNING: COULD NOT DELETE BAD TOKEN FILE')
-
-                self._token = None
+            elif len(self._tokens) < len(saved_tokens):
+                self.save_tokens()
 
         else:
-            self._token = None
+            self._tokens = list()
+
+        self.client = self.create_client(tokens=self._tokens)
 
     # Define application functions
+    def create_client(self, tokens=None):
+        # The rate limiter tracks the budget of each token in the pool separately
+        # Stopping the download queue also ends any wait for the rate limit
+        rate_limiter = gitdata.RateLimiter(reserve=self.reserve, max_wait=self.max_wait, verbose=True,
+                                           stop_event=self.download_queue.stop_event)
+        pool_size = self.max_repos * (self.max_workers + self.max_page_workers)
+        return gitdata.GitHubClient(tokens=tokens, pool_size=pool_size, cache=self.http_cache,
+                                    rate_limiter=rate_limiter, max_page_workers=self.max_page_workers)
+
+    def validate_token(self, token):
+        # Raises an exception if Github doesn't accept the token, otherwise returns the login of its owner
+        client = self.create_client(tokens=[token])
+        user = client.get(client.api_url + '/user')
+        client.close()
+        return user['login']
+
+    def save_tokens(self):
+        with open('mytoken.txt', 'w') as f:
+            f.write('\n'.join(self._tokens))
+
+    def repository_options(self):
+        # Settings every downloaded repository shares with the rest of the session
+        # GraphQL gets pull requests with their diff metrics in bulk but only works with a token
+        engine = 'graphql' if self.client.has_token else 'rest'
+        return dict(client=self.client, max_workers=self.max_workers, output_filepath=self.figures_dir, engine=engine,
+                    sync_dir=self.sync_dir, checkpoint_dir=self.checkpoint_dir, store=self.store,
+                    text_mode=self.text_mode, text_dir=self.text_dir, user_cache=self.user_cache)
+
+    def save_repository_files(self, repo_data):
+        # Append repo data to CSVs, each table is written in one pass
+        pull_path = self.repos_dir + repo_data.owner_name + '-' + repo_data.repo_name
+        gitdata.save_as_csv(self.repositories_csv_path, repo_data)
+        # users.csv has one row per contributor of the session, so it is written again with the new repository added
+        if os.path.exists(self.users_csv_path):
+            os.remove(self.users_csv_path)
+        gitdata.save_many_as_csv(self.users_csv_path, gitdata.combine_users(self.repos))
+        gitdata.save_many_as_csv(pull_path + '.csv', repo_data.pull_requests)
+        # Typed Parquet copies load much faster in other tools, but are only written when pyarrow is installed
+        try:
+            gitdata.save_as_parquet(pull_path + '.parquet', repo_data.pull_requests)
+        except ImportError:
+            pass
+
     def run(self):
-        self.change_menu(self.welcome_menu)
+        try:
+            self.change_menu(self.welcome_menu)
+        finally:
+            # Exiting, or Ctrl-C, stops the background downloads. They checkpoint what they have before they end
+            self.download_queue.stop()
+
+    def run_batch(self, manifest_path, max_repos=None, default_time_window_days=365, pull_filter=None,
+                  sample_size=None):
+        # Download every repository in the manifest without any prompts, then make the figures for all of them
+        entries = gitdata.load_manifest(manifest_path, default_time_window_days=default_time_window_days)
+        return self.download_many(entries, max_repos=max_repos, pull_filter=pull_filter, sample_size=sample_size)
+
+    def run_owner_crawl(self, owner_name, max_repos=None, time_window_days=365, include_forks=False,
+                        include_archived=False, name_pattern=None, pull_filter=None, sample_size=None):
+        # Download every repository of a user or organization, or the ones matching name_pattern
+        owner_name, repo_names = gitdata.list_owner_repositories(owner_name, self.client, include_forks=include_forks,
+                                                                 include_archived=include_archived,
+                                                                 name_pattern=name_pattern)
+        return self.download_many([(owner_name, repo_name, time_window_days) for repo_name in repo_names],
+                                  max_repos=max_repos, pull_filter=pull_filter, sample_size=sample_size)
+
+    def download_many(self, entries, max_repos=None, pull_filter=None, sample_size=None):
+        import time
+        if max_repos is None:
+            max_repos = self.max_repos
+        print(f'Downloading {len(entries)} repositories, {max_repos} at a time')
+
+        start_time = time.time()
+        downloaded = list()
+        failures = list()
+        # An optional PullRequestFilter leaves pull requests out before anything else is downloaded for them
+        options = self.repository_options()
+        options['pull_filter'] = pull_filter
+        # With a sample_size, only that many pull requests per repository get their diff metrics downloaded
+        options['sample_size'] = sample_size
+        for owner_name, repo_name, result in gitdata.download_repositories(entries, max_repos=max_repos,
+                                                                           verbose=False, **options):
+            if isinstance(result, Exception):
+                failures.append((owner_name, repo_name, result))
+                print(f'FAILED {owner_name}/{repo_name}: {result}')
+            else:
+                downloaded.append(result)
+                self.repos.append(result)
+                self.save_repository_files(result)
+                print(f'Done {owner_name}/{repo_name}: {len(result.pull_requests)} pull requests, '
+                      f'{len(result.users)} users')
+        elapsed = time.time() - start_time
+
+        if len(downloaded) > 0:
+            gitdata.AllRepositories(downloaded, output_filepath=self.figures_dir)
+
+        # Summary of how the run went
+        state = self.client.rate_limiter.state()
+        n_pull_requests = sum(len(repo.pull_requests) for repo in downloaded)
+        print()
+        print(f'Repositories downloaded: {len(downloaded)} of {len(entries)}, failed: {len(failures)}')
+        print(f'Pull requests: {n_pull_requests}, users: {sum(len(repo.users) for repo in downloaded)}')
+        print(f'Time: {elapsed:.1f} seconds, {len(downloaded) / max(elapsed, 1e-9) * 60:.1f} repositories per minute, '
+              f'{n_pull_requests / max(elapsed, 1e-9):.1f} pull requests per second')
+        print(f'Requests made: {state["requests_made"]}, retries: {state["retries"]}, '
+              f'seconds waited for rate limits: {state["seconds_waited"]:.1f}, '
+              f'cache hits: {self.http_cache.hits}, duplicate requests shared: {state["coalesced"]}')
+        print(f'Contributor profiles downloaded: {self.user_cache.downloads}, reused: {self.user_cache.hits}')
+        for resource, info in sorted(state['limits'].items()):
+            print(f'Remaining {resource} budget: {info["remaining"]} of {info["limit"]}')
+
+        return failures
 
     def refresh(self):
         clear_screen()
@@ -117,7 +277,7 @@ class WelcomeMenu:
         print()
         input('PRESS ENTER TO CONTINUE')
 
-        if self.app._token is None:
+        if len(self.app._tokens) == 0:
             self.app.change_menu(self.app.input_token_menu)
         else:
             self.app.change_menu(self.app.main_menu)
@@ -129,13 +289,26 @@ class MainMenu:
         self.app = parent_app
 
     def display(self):
+        # Show how much of the Github rate limit is left once a request has reported it
+        core_limit = self.app.client.rate_limiter.state()['limits'].get('core')
+        if core_limit is not None:
+            print(f"Github API requests left: {core_limit['remaining']} of {core_limit['limit']}")
+        # Downloads still going on in the background
+        if len(self.app.download_queue.jobs) > 0:
+            print(self.app.download_queue.summary())
+            for job in self.app.download_queue.active_jobs():
+                print('   ' + str(job))
+
         print()
         print('[1] Download data for a repository')
         print('[2] Summarize a repository which has already been downloaded')
         print('[3] Summarize all repositories that have been downloaded in this session')
         print('[4] Export session data')
-        print('[5] Exit the program')
-        user_input = validate_menu_input(num_options=5)
+        print('[5] Load repositories saved in earlier sessions')
+        print('[6] Download data for every repository of an owner')
+        print('[7] Show download jobs')
+        print('[8] Exit the program')
+        user_input = validate_menu_input(num_options=8)
         self.process_user_input(user_input)
 
     def process_user_input(self, user_input):
@@ -147,9 +320,24 @@ class MainMenu:
             self.app.change_menu(self.app.all_repos_menu)
         elif user_input == 4:
             self.app.change_menu(self.app.export_data_menu)
+        elif user_input == 5:
+            self.app.change_menu(self.app.load_saved_repos_menu)
+        elif user_input == 6:
+            self.app.change_menu(self.app.crawl_owner_menu)
+        elif user_input == 7:
+            self.app.change_menu(self.app.download_jobs_menu)
 
         else:
             import sys
+            # Downloads still going on are stopped on the way out, make sure that is what the user wants
+            n_active = len(self.app.download_queue.active_jobs())
+            if n_active > 0:
+                print(f'{n_active} downloads are not finished. Exiting stops them, downloading them again later '
+                      f'continues where they stopped.')
+                answer = input('Type EXIT to stop them and exit, or press ENTER to return to main menu >> ')
+                if answer.strip().upper() != 'EXIT':
+                    self.app.change_menu(self.app.main_menu)
+                    return
             sys.exit()
 
 
@@ -188,50 +376,14 @@ class GetRepoMenu:
         repo_name = self.validate_repo_input()
         time_window_days = self.validate_time_window()
 
-        print('Downloading and analyzing Github data. Please wait...')
+        # Download in the background, other repositories can be looked at or queued in the meantime
+        self.app.download_queue.submit(owner_name, repo_name, time_window_days)
+        print(f'Queued {owner_name}/{repo_name} for download. Once it is done it can be selected with option [2] of '
+              f'the main menu, option [7] shows how the download is going.')
 
-        # Use these inputs to download data for a repo
-        try:
-            repo_data = gitdata.Repository(owner_name, repo_name, time_window_days=time_window_days,
-                                           token=self.app._token, output_filepath=self.app.figures_dir)
-        except KeyError as e:
-            # If an exception occurs, start over
-            print(str(e))
-            print('Data for an essential field was not found, try another repository.')
-            print()
-            self.display()
-
-        except PermissionError as e:
-            print(str(e))
-            print()
-            self.display()
-
-        except ConnectionError as e:
-            print(str(e))
-            print()
-            self.display()
-
-        except Exception as e:
-            print(str(e))
-            print()
-            self.display()
-
-        # Append this repo data to the app's stored repo data
-        self.app.repos.append(repo_data)
-
-        # Append repo data to CSVs
-        pull_csv_path = self.app.repos_dir + repo_data.owner_name + '-' + repo_data.repo_name + '.csv'
-        gitdata.save_as_csv(self.app.repositories_csv_path, repo_data)
-        for user in repo_data.users:
-            gitdata.save_as_csv(self.app.users_csv_path, user)
-        for pull_request in repo_data.pull_requests:
-            gitdata.save_as_csv(pull_csv_path, pull_request)
-
-        # Set selected_repo_index to the newly downloaded repo
-        self.app.selected_repo_index = len(self.app.repos) - 1
-
-        # Open the repo analysis menu
-        self.app.change_menu(self.app.repo_analysis_menu)
+        print()
+        input('Press ENTER to return to main menu')
+        self.app.change_menu(self.app.main_menu)
 
     def validate_time_window(self):
         valid = False
@@ -264,11 +416,10 @@ class GetRepoMenu:
                 else:
                     try:
                         owned_repos_list = list()
-                        url = f'https://api.github.com/users/{owner}'
-                        json = gitdata.get_github_api_request(url=url, convert_json=True, token=self.app._token)
+                        url = f'{self.app.client.api_url}/users/{owner}'
+                        json = self.app.client.get(url=url, convert_json=True)
                         owner = json['login']
-                        repos = gitdata.get_github_api_request(url=json["repos_url"], convert_json=True,
-                                                               token=self.app._token)
+                        repos = self.app.client.get(url=json["repos_url"], convert_json=True)
                         for repo in repos:
                             if repo['owner']['login'] == owner:
                                 owned_repos_list.append(repo['name'])
@@ -305,13 +456,15 @@ class GetRepoMenu:
                         for existing_repo in self.app.repos:
                             if (self._current_owner == existing_repo.owner_name) & (repo == existing_repo.repo_name):
                                 already_downloaded = True
-                        if not already_downloaded:
-                            url = f'https://api.github.com/repos/{self._current_owner}/{repo}'
-                            gitdata.get_github_api_request(url=url, convert_json=True, token=self.app._token)
-                            valid = True
-                        else:
+                        if already_downloaded:
                             print(
                                 'Data for this repository has already been downloaded. Type EXIT to return to main menu.')
+                        elif self.app.download_queue.is_active(self._current_owner, repo):
+                            print('This repository is already being downloaded. Type EXIT to return to main menu.')
+                        else:
+                            url = f'{self.app.client.api_url}/repos/{self._current_owner}/{repo}'
+                            self.app.client.get(url=url, convert_json=True)
+                            valid = True
 
                     except ValueError:
                         print(
@@ -396,6 +549,12 @@ class SelectRepoMenu:
                 menu_option_number += 1
         else:
             print('No repo data has been downloaded yet')
+        # Repositories still downloading are listed here as soon as they are done
+        active_jobs = self.app.download_queue.active_jobs()
+        if len(active_jobs) > 0:
+            print('Still downloading:')
+            for job in active_jobs:
+                print('   ' + str(job))
 
         print(f'[{menu_option_number}] Return to main menu')
 
@@ -455,7 +614,8 @@ class ExportDataMenu:
                             else:
                                 dst = dir.joinpath(pathlib.Path(export_name))
                                 if not os.path.exists(dst):
-                                    shutil.copytree(self.app.data_dir, dst)
+                                    shutil.copytree(self.app.data_dir, dst,
+                                                    ignore=shutil.ignore_patterns(*self.app.export_ignore_patterns))
                                     valid = True
                                     name_valid = True
                                     print('Data succesfully copied to:', dst.absolute())
@@ -472,6 +632,224 @@ class ExportDataMenu:
                     print(str(e))
 
 
+class LoadSavedReposMenu:
+    def __init__(self, parent_app):
+        self.name = 'Load Saved Repos'
+        self.app = parent_app
+
+    def display(self):
+        print()
+        # Load every saved repository that isn't in this session yet
+        loaded_names = [(repo.owner_name, repo.repo_name) for repo in self.app.repos]
+        n_loaded = 0
+        for record in self.app.store.list_repositories():
+            if (record['owner_name'], record['repo_name']) not in loaded_names:
+                repo_data = gitdata.Repository(record['owner_name'], record['repo_name'],
+                                               time_window_days=record['time_window_days'], client=self.app.client,
+                                               output_filepath=self.app.figures_dir, engine='store',
+                                               store=self.app.store, text_mode=self.app.text_mode,
+                                               text_dir=self.app.text_dir)
+                self.app.repos.append(repo_data)
+                n_loaded += 1
+
+        if n_loaded == 0:
+            print('No other repositories have been saved in earlier sessions')
+        else:
+            print(f'Loaded {n_loaded} repositories. Select them with option [2] of the main menu.')
+
+        print()
+        input('Press ENTER to return to main menu')
+        self.app.change_menu(self.app.main_menu)
+
+
+class CrawlOwnerMenu:
+    def __init__(self, parent_app):
+        self.name = 'Download All Repos Of An Owner'
+        self.app = parent_app
+
+    def display(self):
+        # Reuse the prompts of the single repository download
+        print()
+        print('Type in a Github owner name to download all of its repositories')
+        print('   *Or return to main menu by typing EXIT')
+        owner_name = self.app.get_repo_menu.validate_owner_input()
+        print()
+        name_pattern = input('Only download repositories matching a pattern like api-* (or press ENTER for all) >> ')
+        time_window_days = self.app.get_repo_menu.validate_time_window()
+
+        # Every repository becomes a download job, they are worked through in the background
+        try:
+            owner_name, repo_names = gitdata.list_owner_repositories(owner_name, self.app.client,
+                                                                     name_pattern=name_pattern.strip() or None)
+            downloaded = [(repo.owner_name, repo.repo_name) for repo in self.app.repos]
+            n_queued = 0
+            for repo_name in repo_names:
+                if (owner_name, repo_name) in downloaded or self.app.download_queue.is_active(owner_name, repo_name):
+                    continue
+                self.app.download_queue.submit(owner_name, repo_name, time_window_days)
+                n_queued += 1
+            print(f'Queued {n_queued} repositories for download, option [7] of the main menu shows how it is going.')
+        except Exception as e:
+            print(str(e))
+
+        print()
+        input('Press ENTER to return to main menu')
+        self.app.change_menu(self.app.main_menu)
+
+
+class DownloadJobsMenu:
+    def __init__(self, parent_app):
+        self.name = 'Download Jobs'
+        self.app = parent_app
+
+    def display(self):
+        queue = self.app.download_queue
+        print()
+        if len(queue.jobs) == 0:
+            print('No repositories have been queued for download in this session')
+        else:
+            for job in queue.jobs:
+                print(str(job))
+            print()
+            print(queue.summary())
+            state = self.app.client.rate_limiter.state()
+            print(f'Requests made: {state["requests_made"]}, retries: {state["retries"]}, '
+                  f'seconds waited for rate limits: {state["seconds_waited"]:.1f}')
+            if any(job.status == 'failed' for job in queue.jobs):
+                print('Progress of failed downloads was checkpointed, downloading them again continues where they '
+                      'stopped.')
+
+        # Status changes while this menu is open, so it can be shown again
+        print()
+        user_input = input('Press ENTER to refresh, or type EXIT to return to main menu >> ').strip()
+        if user_input.upper() == 'EXIT':
+            self.app.change_menu(self.app.main_menu)
+        else:
+            self.app.refresh()
+
+
+class DownloadJob:
+    def __init__(self, owner_name, repo_name, time_window_days):
+        self.owner_name = owner_name
+        self.repo_name = repo_name
+        self.time_window_days = time_window_days
+        self.status = 'queued'  # 'queued', 'running', 'done' or 'failed'
+        self.repo = None
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+
+    def elapsed(self):
+        import time
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def __str__(self):
+        name = f'{self.owner_name}/{self.repo_name}'
+        if self.status == 'queued':
+            return f'{name}: waiting'
+        elif self.status == 'running':
+            return f'{name}: downloading for {self.elapsed():.0f} seconds'
+        elif self.status == 'done':
+            n_pull_requests = len(self.repo.pull_requests)
+            return (f'{name}: {n_pull_requests} pull requests in {self.elapsed():.0f} seconds '
+                    f'({n_pull_requests / max(self.elapsed(), 1e-9):.1f} per second)')
+        return f'{name}: failed, {self.error}'
+
+
+class DownloadQueue:
+    def __init__(self, parent_app, max_workers=2):
+        import queue
+        import threading
+        self.app = parent_app
+        self.max_workers = max_workers  # Repositories downloaded at the same time
+        self.jobs = list()
+        self._pending = queue.Queue()
+        self._save_lock = threading.Lock()
+        self._workers = list()
+        self.stop_event = threading.Event()  # Passed to every download and the rate limiter, see stop
+
+    def submit(self, owner_name, repo_name, time_window_days):
+        import threading
+        job = DownloadJob(owner_name, repo_name, time_window_days)
+        self.jobs.append(job)
+        self._pending.put(job)
+
+        # Workers are started with the first jobs. Exiting stops them with stop, being daemon threads only matters if
+        # one doesn't stop in time or the program ends some other way
+        if len(self._workers) < self.max_workers:
+            worker = threading.Thread(target=self.work, daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        return job
+
+    def work(self):
+        import time
+        while not self.stop_event.is_set():
+            job = self._pending.get()
+            if job is None:
+                break
+            job.status = 'running'
+            job.started_at = time.time()
+            try:
+                repo_data = gitdata.Repository(job.owner_name, job.repo_name, time_window_days=job.time_window_days,
+                                               verbose=False, stop_event=self.stop_event,
+                                               **self.app.repository_options())
+                # The session files are written by one worker at a time
+                with self._save_lock:
+                    self.app.repos.append(repo_data)
+                    self.app.save_repository_files(repo_data)
+                job.repo = repo_data
+                job.finished_at = time.time()
+                job.status = 'done'
+            except Exception as e:
+                job.error = e
+                job.finished_at = time.time()
+                job.status = 'failed'
+
+    def stop(self, timeout=30):
+        import time
+        # Running downloads end after their current page or request and checkpoint their progress, waiting jobs are
+        # not started. A worker still busy after timeout seconds is left behind, it is a daemon thread
+        if len(self.active_jobs()) > 0:
+            print('Stopping downloads, their progress is checkpointed...')
+        self.stop_event.set()
+        for worker in self._workers:
+            self._pending.put(None)
+        deadline = time.time() + timeout
+        for worker in self._workers:
+            worker.join(max(0, deadline - time.time()))
+        if any(worker.is_alive() for worker in self._workers):
+            print(f'WARNING: Some downloads did not stop within {timeout} seconds and were abandoned')
+
+    def is_active(self, owner_name, repo_name):
+        return any(job.owner_name == owner_name and job.repo_name == repo_name for job in self.active_jobs())
+
+    def active_jobs(self):
+        return [job for job in self.jobs if job.status in ('queued', 'running')]
+
+    def summary(self):
+        import time
+        counts = {status: sum(1 for job in self.jobs if job.status == status)
+                  for status in ('running', 'queued', 'done', 'failed')}
+        summary = (f"Downloads: {counts['running']} running, {counts['queued']} waiting, {counts['done']} done, "
+                   f"{counts['failed']} failed")
+
+        # Throughput from the start of the first download until now, or until the last one finished
+        started = [job.started_at for job in self.jobs if job.started_at is not None]
+        if counts['done'] > 0:
+            if len(self.active_jobs()) > 0:
+                end = time.time()
+            else:
+                end = max(job.finished_at for job in self.jobs)
+            elapsed = max(end - min(started), 1e-9)
+            n_pull_requests = sum(len(job.repo.pull_requests) for job in self.jobs if job.status == 'done')
+            summary += (f", {counts['done'] / elapsed * 60:.1f} repositories per minute, "
+                        f"{n_pull_requests / elapsed:.1f} pull requests per second")
+        return summary
+
+
 class InputTokenMenu:
     def __init__(self, parent_app):
         self.name = 'Input Github Access Token'
@@ -483,25 +861,31 @@ class InputTokenMenu:
         print('Try this link: https://github.com/settings/tokens?type=beta')
         print(
             'Or read these instructions: https://docs.github.com/en/authentication/keeping-your-account-and-data-secure/managing-your-personal-access-tokens')
+        print('Several tokens can be entered separated by spaces, requests will be shared between them.')
         print('Or type SKIP to continue without an access token. Rate limits may limit your downloads.')
         valid = False
         while not valid:
             print()
-            user_input = input('Input a Github Access Token or type SKIP > ').strip()
+            user_input = input('Input one or more Github Access Tokens or type SKIP > ').strip()
             if user_input.upper() == 'SKIP':
                 valid = True
                 self.app.change_menu(self.app.main_menu)
             else:
                 try:
-                    user = gitdata.get_github_api_request(url='https://api.github.com/user', token=user_input)
-                    with open('mytoken.txt', 'w') as f:
-                        f.write(user_input)
-                    print('Successfully registered this token owned by', user['login'])
+                    tokens = user_input.split()
+                    logins = [self.app.validate_token(token) for token in tokens]
+                    # Use the new tokens for every request made in this session
+                    self.app._tokens = tokens
+                    self.app.save_tokens()
+                    self.app.client.close()
+                    self.app.client = self.app.create_client(tokens=tokens)
+                    for login in logins:
+                        print('Successfully registered a token owned by', login)
                     input('Press ENTER to continue')
                     valid = True
                     self.app.change_menu(self.app.main_menu)
                 except PermissionError:
-                    print('This token does not appear to be valid')
+                    print('At least one of these tokens does not appear to be valid')
                 except Exception as e:
                     print(str(e))
 
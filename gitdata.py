@@ -1,23 +1,32 @@
 import os
+import threading
 
 
 class AllRepositories:
     analysis_number = 0
 
-    def __init__(self, repos, output_filepath=None, time_window_days=None):
+    def __init__(self, repos=None, output_filepath=None, time_window_days=None, store=None):
+        # Without a list of repos, every repository saved in the store is loaded from it
+        if repos is None:
+            repos = load_repositories(store, time_window_days=time_window_days) if store is not None else list()
         self.repos = repos
         self.start_date = None
         self.end_date = None
         self.output_filepath = output_filepath
         self.time_window_days = time_window_days
+        self.daily_tallies = None
+        self.daily_tallies_by_repo = None
 
         AllRepositories.analysis_number += 1
 
         if self.count_total_pull_requests() > 0:
             self.fill_analysis_dates()
             self.fill_filepath()
+            # Count opened, closed and merged pull requests per day once, every figure uses these tallies
+            self.compute_daily_tallies()
             self.display_pulls_per_day()
             self.display_open_vs_closed_per_day()
+            self.display_pulls_per_day_by_repo()
             self.display_users_per_repository()
             print('Figures have been saved to: ' + os.path.abspath(self.output_filepath))
         else:
@@ -62,24 +71,39 @@ class AllRepositories:
             self.start_date = datetime.strptime(dates[0], '%Y-%m-%dT%H:%M:%SZ').date()
             self.end_date = datetime.strptime(dates[-1], '%Y-%m-%dT%H:%M:%SZ').date()
 
-    def display_pulls_per_day(self):
+    def compute_daily_tallies(self):
         import pandas as pd
+
+        # Collect the dates of every event for every pull request in one table
         dfs = list()
         for repo in self.repos:
-            temp_df = repo.pull_requests_to_pandas()
+            temp_df = repo.pull_requests_to_pandas(['created_at', 'closed_at', 'merged_at'])
+            temp_df = temp_df.assign(repo=f'{repo.owner_name}/{repo.repo_name}')
             dfs.append(temp_df)
-
         df = pd.concat(dfs)
 
-        # this will remove the hours, minutes and seconds data from the created_at field and leave us with just the date
-        df['created_at'] = pd.to_datetime(df['created_at'].str.split('T').str[0])
+        # Turn it into one row per event, keeping only the date part of the timestamps
+        events = df.melt(id_vars='repo', value_vars=['created_at', 'closed_at', 'merged_at'], var_name='event',
+                         value_name='date').dropna(subset=['date'])
+        events['event'] = events['event'].map({'created_at': 'opened', 'closed_at': 'closed', 'merged_at': 'merged'})
+        events['date'] = events['date'].dt.normalize()
 
+        # Count every event per day and repo in one pass, days without events get a tally of 0
+        analysis_days = pd.date_range(start=self.start_date, end=self.end_date, freq='1D')
+        tallies = events.groupby(['date', 'event', 'repo']).size().unstack(['event', 'repo'], fill_value=0)
+        tallies = tallies.reindex(analysis_days, fill_value=0).sort_index(axis=1)
+        tallies.index.name = 'date'
+
+        # Daily tallies for each repo, with (event, repo) columns, and for all repos together
+        self.daily_tallies_by_repo = tallies
+        self.daily_tallies = tallies.T.groupby(level='event').sum().T.reindex(columns=['opened', 'closed', 'merged'],
+                                                                             fill_value=0)
+        return self.daily_tallies
+
+    def display_pulls_per_day(self):
         try:
-            # create dataframe of last 60 days
-            analysis_days = pd.DataFrame({'date': pd.date_range(start=self.start_date, end=self.end_date, freq='1d')})
-            # create a tally column that queries our pull requests to find the number of requests opened for each day
-            analysis_days['tally'] = analysis_days['date'].apply(lambda x: len(df.query("created_at == @x")))
-            # plot the tallies per day
+            # plot the number of pull requests opened per day
+            analysis_days = self.daily_tallies[['opened']].rename(columns={'opened': 'tally'}).reset_index()
             ax = analysis_days.plot.line(x='date', y='tally')
             # display and save fig
             # print(ax)
@@ -94,26 +118,10 @@ class AllRepositories:
         return None
 
     def display_open_vs_closed_per_day(self):
-        import pandas as pd
-        dfs = list()
-
-        for repo in self.repos:
-            temp_df = repo.pull_requests_to_pandas()
-            dfs.append(temp_df)
-
-        df = pd.concat(dfs)
-
-        # this will remove the hours, minutes and seconds data from the created_at and closed_at fields so we only have the date
-        df['created_at'] = pd.to_datetime(df['created_at'].str.split('T').str[0])
-        df['closed_at'] = pd.to_datetime(df['closed_at'].str.split('T').str[0])
-
         try:
-            # create dataframe of last 60 days
-            analysis_days = pd.DataFrame({'date': pd.date_range(start=self.start_date, end=self.end_date, freq='1d')})
-            # create an open and close tally column that queries our pull requests to find the number of requests opened and closed for each day
-            analysis_days['open_tally'] = analysis_days['date'].apply(lambda x: len(df.query("created_at == @x")))
-            analysis_days['close_tally'] = analysis_days['date'].apply(lambda x: len(df.query("closed_at == @x")))
             # plot open vs close per day, this will automatically color between open and close tallies
+            analysis_days = self.daily_tallies[['opened', 'closed']].rename(
+                columns={'opened': 'open_tally', 'closed': 'close_tally'}).reset_index()
             ax = analysis_days.plot.line(x='date')
             # display and save fig
             # print(ax)
@@ -128,6 +136,21 @@ class AllRepositories:
 
         return None
 
+    def display_pulls_per_day_by_repo(self):
+        try:
+            # plot one line per repo so their activity can be compared
+            if 'opened' in self.daily_tallies_by_repo.columns.get_level_values('event'):
+                ax = self.daily_tallies_by_repo['opened'].plot.line()
+                ax.set_ylabel('pull requests opened')
+                ax.figure.savefig(self.output_filepath + 'pulls_per_day_by_repo.png', bbox_inches='tight')
+
+        except Exception as e:
+            # this is just for troubleshooting our code and testing, we shouldn't need it once we have this perfected
+            print('something is wrong with the data, here is the error: ')
+            print(e)
+
+        return None
+
     def display_users_per_repository(self):
         import pandas as pd
         # initialize list of dicts
@@ -161,25 +184,200 @@ class GitHubLicense:
 
 
 class Repository:
-    def __init__(self, owner_name, repo_name, time_window_days=365, verbose=True, token=None, output_filepath=None):
+    csv_columns = ('owner_name', 'repo_name', 'n_pull_requests', 'n_users')
+
+    def __init__(self, owner_name, repo_name, time_window_days=365, verbose=True, token=None, output_filepath=None,
+                 max_workers=8, client=None, engine='rest', sync_dir=None, store=None, text_mode='keep',
+                 text_max_chars=280, text_dir=None, user_cache=None, lazy=False, pull_filter=None, sample_size=None,
+                 sample_seed=None, checkpoint_dir=None, checkpoint_every=5, stop_event=None):
         # Assign properties
         self.owner_name = owner_name
         self.repo_name = repo_name
         self.time_window_days = time_window_days
         self.verbose = verbose
-        self.__token = token
         self.output_filepath = output_filepath
+        self.max_workers = max_workers  # Maximum number of pull request details downloaded at the same time
+        # 'rest' lists pull requests and downloads each one's diff metrics separately, 'graphql' gets both in bulk,
+        # 'search' lets the search API apply the time window, 'store' loads what was saved in the SessionStore
+        # without going to the network
+        if engine not in ('rest', 'graphql', 'search', 'store'):
+            raise ValueError(f"Unknown engine '{engine}', use 'rest', 'graphql', 'search' or 'store'")
+        if engine == 'store' and store is None:
+            raise ValueError("The 'store' engine needs a SessionStore to load from")
+        self.engine = engine
+        self.store = store  # Optional SessionStore that downloaded data is saved to
+        # Folder where the last sync of each repository is kept, so later downloads only fetch what changed
+        self.sync_dir = sync_dir
+        # Folder where an unfinished download is checkpointed every checkpoint_every pages of pull requests, and when
+        # it fails. Downloading the same repository again resumes from there instead of starting over
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint_every = checkpoint_every
+        # Setting this threading.Event stops a download after the current page, with its progress checkpointed
+        self.stop_event = stop_event
+        self._known_users = dict()  # Profiles loaded from the store, keyed by login
+        # Downloaded contributor profiles, repositories sharing a cache only download each profile once per its TTL.
+        # Without one, the process wide cache is used
+        if user_cache is None:
+            user_cache = get_default_user_cache()
+        self.user_cache = user_cache
+        # How pull request bodies are held in memory, see ColumnarTable, 'sidecar' writes them to a file in text_dir
+        self.text_mode = text_mode
+        self.text_max_chars = text_max_chars
+        self.text_dir = text_dir
+        # A lazy repository only lists its pull requests at first. Diff metrics and contributor profiles are downloaded
+        # the first time an analysis needs them, so summaries like total_pulls_open cost only the list pages
+        self.lazy = lazy
+        # Pull requests this filter excludes are dropped from the list pages, before their details or their authors'
+        # profiles are downloaded
+        if pull_filter is None:
+            pull_filter = PullRequestFilter()
+        self.pull_filter = pull_filter
+        # For very large repositories, diff metrics can be downloaded for a random sample of sample_size pull requests
+        # only, taken from every state and month in proportion. Analyses then report estimates with confidence
+        # intervals, see sample_strata
+        self.sample_size = sample_size
+        self.sample_seed = sample_seed
+        self.sample_strata = None
+        self._diff_metrics_loaded = True
+        self._users_loaded = False
+        self._load_lock = threading.RLock()
+
+        # Share one HTTP client between this repository and all of its pull requests and users
+        if client is None:
+            client = get_default_client(token)
+        self.client = client
 
         # Initialize empty variables for pull request data and contributing user data
-        self.pull_requests = tuple()
-        self.users = tuple()
+        self.pull_requests = self.make_pull_request_table()
+        self._users = UserTable(client=self.client)
+        self.failed_pulls = tuple()
 
         # Automatically run function to get pull requests and users
         self.get_pulls()
-        self.get_users()
+        if not self.lazy:
+            self.ensure_diff_metrics()
+            self.get_users()
+            self.save_state()
 
         self.fill_filepath()
 
+    @property
+    def pull_requests(self):
+        return self._pull_requests
+
+    @pull_requests.setter
+    def pull_requests(self, pull_requests):
+        # The table being replaced deletes its sidecar file, the new one was built from it already
+        replaced = getattr(self, '_pull_requests', None)
+        self._pull_requests = pull_requests
+        if isinstance(replaced, ColumnarTable) and replaced is not pull_requests:
+            replaced.close()
+
+    @property
+    def users(self):
+        # Lazy repositories download the contributor profiles the first time they are used
+        if not self._users_loaded:
+            with self._load_lock:
+                if not self._users_loaded:
+                    self.get_users()
+                    self.save_when_loaded()
+        return self._users
+
+    @users.setter
+    def users(self, users):
+        self._users = users
+        self._users_loaded = True
+
+    def ensure_diff_metrics(self):
+        # Lazy repositories download the diff metrics of every pull request the first time an analysis needs them
+        if self._diff_metrics_loaded:
+            return
+        with self._load_lock:
+            if not self._diff_metrics_loaded:
+                if self.sample_size is not None:
+                    self.hydrate_sample()
+                else:
+                    missing = [pull for pull in self.pull_requests if pull.num_commits is None]
+                    self.failed_pulls = tuple(self.hydrate_pulls(missing))
+                self._diff_metrics_loaded = True
+                self.save_when_loaded()
+
+    def hydrate_sample(self):
+        import random
+        # Group the listed pull requests by state and the month they were opened in, and download the diff metrics
+        # of a random sample of each group in proportion to its size. Every group gets at least two draws, without
+        # them its spread is unknown. When the sample is too small for that, groups are merged by state only, or
+        # into one
+        for level in (2, 1, 0):
+            strata = self.get_sample_strata(level)
+            if self.sample_size >= 2 * len(strata):
+                break
+        allocation = allocate_sample(self.sample_size, {key: len(indices) for key, indices in strata.items()},
+                                     minimum=2)
+
+        rng = random.Random(self.sample_seed)
+        self.sample_strata = {key: (len(indices), sorted(rng.sample(indices, allocation[key])))
+                              for key, indices in strata.items()}
+        sampled = [self.pull_requests[index] for size, indices in self.sample_strata.values() for index in indices]
+        if self.verbose:
+            if level < 2:
+                print(f'WARNING: A sample of {self.sample_size} is too small for two pull requests from every state '
+                      f'and month, sampling by {"state" if level == 1 else "repository"} instead')
+            print(f'Downloading detailed data for a sample of {len(sampled)} of {len(self.pull_requests)} pull '
+                  f'requests from {len(strata)} groups...')
+        self.failed_pulls = tuple(self.hydrate_pulls(sampled))
+
+    def get_sample_strata(self, level=2):
+        # Indices of the listed pull requests grouped by state and month (level 2), by state (level 1) or all in one
+        # group (level 0). The keys are tuples with one value per level
+        strata = dict()
+        for index in range(len(self.pull_requests)):
+            created_at = self.pull_requests.get_value('created_at', index)
+            key = (self.pull_requests.get_value('state', index), created_at[:7] if created_at is not None else None)
+            strata.setdefault(key[:level], list()).append(index)
+        return strata
+
+    @property
+    def sampled(self):
+        return self.sample_strata is not None and sum(len(indices) for size, indices in
+                                                      self.sample_strata.values()) < len(self.pull_requests)
+
+    @property
+    def syncable(self):
+        # Filtered or sampled downloads are never synced or stored, see save_state
+        return not self.pull_filter.active and self.sample_size is None
+
+    def save_when_loaded(self):
+        # A lazy repository is only saved once it is complete, so a partial download is never synced or stored
+        if self.lazy and self._diff_metrics_loaded and self._users_loaded:
+            self.save_state()
+
+    def save_state(self):
+        if self.engine != 'store':
+            # Filtered or sampled downloads are incomplete. Synced they would be missing data, and saving one to the
+            # store would delete the pull requests an earlier full download had stored
+            if self.sync_dir is not None and self.syncable:
+                self.save_sync_state()
+            if self.store is not None and self.syncable:
+                self.store.save_repository(self)
+        # The download is complete, there is nothing left to resume
+        if self.checkpoint_dir is not None and os.path.exists(self.get_checkpoint_path()):
+            os.remove(self.get_checkpoint_path())
+
+    def make_pull_request_table(self, pull_requests_list=()):
+        import tempfile
+        pull_requests_list = list(pull_requests_list)
+        sidecar_path = None
+        if self.text_mode == 'sidecar' and len(pull_requests_list) > 0:
+            # Every table gets its own file, so a rebuilt table can still read the bodies of the one it replaces.
+            # Empty tables have nothing to write and get none
+            fd, sidecar_path = tempfile.mkstemp(prefix=f'{self.owner_name}-{self.repo_name}-', suffix='.body.z',
+                                                dir=self.text_dir)
+            os.close(fd)
+
+        return PullRequestTable(pull_requests_list, self.owner_name, self.repo_name, self.client,
+                                text_mode=self.text_mode, text_max_chars=self.text_max_chars, sidecar_path=sidecar_path)
+
     def fill_filepath(self):
         import os
 
@@ -199,106 +397,638 @@ class Repository:
 
     def get_pulls_as_json(self):
         # GitHub API endpoint for pull requests
-        url = f"https://api.github.com/repos/{self.owner_name}/{self.repo_name}/pulls"
+        url = f"{self.client.api_url}/repos/{self.owner_name}/{self.repo_name}/pulls"
 
-        pull_requests_json = get_github_api_request(url=url, params={'state': 'all', 'per_page': '100'},
-                                                    time_window_days=self.time_window_days, token=self.__token)
+        params = {'state': 'all', 'per_page': '100'}
+        params.update(self.pull_filter.rest_params())
+        pull_requests_json = self.client.get(url=url, params=params, time_window_days=self.time_window_days)
 
         return pull_requests_json
 
     def get_pulls(self):
-        # Get pull requests from github in json format
-        pulls_json = self.get_pulls_as_json()
+        if self.engine == 'store':
+            self.get_pulls_from_store()
+            return
+
+        # Only download what changed if this repository was synced before
+        sync_state = self.load_sync_state() if self.syncable else None
+        if sync_state is not None:
+            self.get_pulls_incremental(sync_state)
+            return
+
+        if self.engine == 'graphql':
+            self.get_pulls_graphql()
+            return
+
+        if self.engine == 'search':
+            self.get_pulls_search()
+            return
+
+        # Sampled repositories only list their pull requests here, the sample is downloaded by ensure_diff_metrics
+        if self.lazy or self.sample_size is not None:
+            self.get_pulls_list()
+            return
+
+        self.get_pulls_streaming()
+
+    def get_pulls_list(self):
+        # Only the list pages are downloaded, ensure_diff_metrics gets the rest when it is needed
+        pull_requests_list = list()
+        for json_record in self.get_pulls_as_json():
+            if not self.pull_filter.matches(PullRequestFilter.fields_from_json(json_record)):
+                continue
+            pull_request_instance = PullRequest(client=self.client)
+            pull_request_instance.fill_from_json(json_record, get_details=False)
+            pull_requests_list.append(pull_request_instance)
+        self._diff_metrics_loaded = False
+
+        # Store the pull requests column by column, they are read back through light row views
+        self.pull_requests = self.make_pull_request_table(pull_requests_list)
+
+    def get_pulls_streaming(self):
+        import concurrent.futures
+
+        # Diff metrics and contributor profiles are downloaded while the next pages of pull requests are still being
+        # listed. The number of downloads in flight is bounded, so listing waits when it gets too far ahead
+        url = f"{self.client.api_url}/repos/{self.owner_name}/{self.repo_name}/pulls"
+        max_pending = max(1, self.max_workers) * 4
+        users_batch_size = USERS_BATCH_SIZE if self.client.has_token else 1
+        params = {'state': 'all', 'per_page': '100'}
+        params.update(self.pull_filter.rest_params())
+
+        # Resume an earlier download that stopped part way, its pull requests and profiles are not downloaded again
+        pull_requests_list, pages_listed, listed_all = self.load_checkpoint()
+        listed_numbers = set(pull.number for pull in pull_requests_list)
+        if listed_all:
+            # Every page was listed before, only the missing diff metrics and profiles are left
+            page_iterator = iter(())
+        elif pages_listed > 0:
+            # Pages listed before the checkpoint are skipped. New pull requests push older ones onto later pages, so
+            # the first pages listed now can repeat some that were already seen
+            page_iterator = self.client.iter_pages(url, params=dict(params, page=str(pages_listed + 1)),
+                                                   time_window_days=self.time_window_days)
+        else:
+            page_iterator = self.client.iter_pages(url, params=params, time_window_days=self.time_window_days)
+
+        detail_futures = dict()
+        user_futures = list()
+        # Downloads not finished yet, diff metrics and profiles are counted apart
+        pending_details = set()
+        pending_users = set()
+        seen_users = set()
+        claimed_users = list()
+        users_batch = list()
+
+        def checkpoint(listed_all):
+            import time
+            # Profiles downloaded so far are kept with the pull requests, whether their diff metrics are in or not
+            users = self.user_cache.export(seen_users)
+            for future in user_futures:
+                if future.done() and future.exception() is None:
+                    users.update({login: dict(record, downloaded_at=time.time())
+                                  for login, record in future.result().items()})
+            self.save_checkpoint(pull_requests_list, users, pages_listed=pages_listed, listed_all=listed_all)
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+                for pull_request_instance in pull_requests_list:
+                    if pull_request_instance.num_commits is None:
+                        future = executor.submit(pull_request_instance.get_diff_metrics)
+                        detail_futures[future] = pull_request_instance
+                        pending_details.add(future)
+
+                for page in page_iterator:
+                    for json_record in page:
+                        # Filtered out pull requests never cost a detail request or a profile lookup
+                        if not self.pull_filter.matches(PullRequestFilter.fields_from_json(json_record)):
+                            continue
+                        if json_record['number'] in listed_numbers:
+                            continue
+                        listed_numbers.add(json_record['number'])
+                        pull_request_instance = PullRequest(client=self.client)
+                        pull_request_instance.fill_from_json(json_record, get_details=False)
+                        pull_requests_list.append(pull_request_instance)
+
+                        future = executor.submit(pull_request_instance.get_diff_metrics)
+                        detail_futures[future] = pull_request_instance
+                        pending_details.add(future)
+
+                        # Contributor profiles are requested as soon as enough new logins have been seen, unless
+                        # another repository sharing the cache already has them or is downloading them
+                        login = pull_request_instance.user
+                        if login not in seen_users:
+                            seen_users.add(login)
+                            if self.user_cache.get(login, wait=False) is None and self.user_cache.claim(login):
+                                claimed_users.append(login)
+                                users_batch.append(login)
+                            if len(users_batch) >= users_batch_size:
+                                future = executor.submit(self.download_user_profiles, users_batch)
+                                user_futures.append(future)
+                                pending_users.add(future)
+                                users_batch = list()
+
+                        if len(pending_details) + len(pending_users) >= max_pending:
+                            done, not_done = concurrent.futures.wait(pending_details | pending_users,
+                                                                     return_when=concurrent.futures.FIRST_COMPLETED)
+                            pending_details -= done
+                            pending_users -= done
+
+                    pages_listed += 1
+                    if self.checkpoint_dir is not None and pages_listed % self.checkpoint_every == 0:
+                        checkpoint(listed_all=False)
+                    self.check_stopped()
+
+                    if self.verbose:
+                        print(f'Listed {len(pull_requests_list)} pull requests, '
+                              f'{sum(future.done() for future in detail_futures)} downloaded...')
+
+                if len(users_batch) > 0:
+                    user_futures.append(executor.submit(self.download_user_profiles, users_batch))
+
+            # Profiles that could not be downloaded here are tried again by get_users
+            for future in user_futures:
+                if future.exception() is None:
+                    self.user_cache.update(future.result())
+            # Keep the finished listing too, in case downloading the remaining profiles fails
+            if self.checkpoint_dir is not None:
+                checkpoint(listed_all=True)
+        except BaseException:
+            # Failed or interrupted, including with Ctrl-C. The downloads that were in flight have finished by now
+            if self.checkpoint_dir is not None:
+                checkpoint(listed_all=False)
+            raise
+        finally:
+            # Repositories waiting for the profiles this one claimed stop waiting, even if listing failed
+            self.user_cache.release(claimed_users)
+
+        # A single failed download should not stop the rest of the batch
+        failed = list()
+        for future, pull in detail_futures.items():
+            if future.exception() is not None:
+                failed.append((pull, future.exception()))
+        self.failed_pulls = tuple(self.check_failed_pulls(failed, len(pull_requests_list)))
+
+        # Store the pull requests column by column, they are read back through light row views
+        self.pull_requests = self.make_pull_request_table(pull_requests_list)
+
+    def get_pulls_search(self):
+        import datetime
+
+        # Let the search API select the pull requests created in the time window instead of paging through all of them
+        end_date = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None, microsecond=0)
+        if self.time_window_days is not None:
+            start_date = end_date - datetime.timedelta(days=self.time_window_days)
+        else:
+            start_date = datetime.datetime.strptime(SEARCH_START_DATE, '%Y-%m-%dT%H:%M:%SZ')
+        items = self.search_pulls(start_date, end_date)
+        if self.verbose:
+            print(f'Found {len(items)} pull requests in this time window. Downloading detailed data...')
+
+        # Ranges don't overlap, but keep each pull request once in case one changed while the search ran
+        pulls_by_number = dict()
+        for item in items:
+            if not self.pull_filter.matches(PullRequestFilter.fields_from_json(item)):
+                continue
+            pull_request_instance = PullRequest(client=self.client)
+            pull_request_instance.fill_from_search(item)
+            pulls_by_number[pull_request_instance.number] = pull_request_instance
+        pull_requests_list = sorted(pulls_by_number.values(), key=lambda pull: pull.created_at, reverse=True)
+
+        # Search results don't include diff metrics, download them for all pull requests in parallel. Lazy and
+        # sampled repositories leave that to ensure_diff_metrics
+        if self.lazy or self.sample_size is not None:
+            self._diff_metrics_loaded = False
+        else:
+            self.failed_pulls = tuple(self.hydrate_pulls(pull_requests_list))
+
+        # Store the pull requests column by column, they are read back through light row views
+        self.pull_requests = self.make_pull_request_table(pull_requests_list)
+
+    def search_pulls(self, start_date, end_date):
+        import datetime
+        url = f"{self.client.api_url}/search/issues"
+        created = f"{start_date.strftime('%Y-%m-%dT%H:%M:%SZ')}..{end_date.strftime('%Y-%m-%dT%H:%M:%SZ')}"
+        # The filter is added to the query, so Github leaves out excluded pull requests itself
+        query = f'repo:{self.owner_name}/{self.repo_name} is:pr created:{created} '
+        query += self.pull_filter.search_qualifiers()
+        params = {'q': query.strip(), 'sort': 'created', 'order': 'desc', 'per_page': '100'}
+
+        items = list()
+        for response in self.client.iter_responses(url, params=params):
+            response_json = self.client.parse_json(response)
+
+            # The search API returns at most 1,000 results for a query. Split a range that has more in two halves
+            # and search each one on its own
+            if len(items) == 0 and response_json['total_count'] > SEARCH_RESULTS_LIMIT \
+                    and end_date - start_date > datetime.timedelta(seconds=1):
+                middle_date = start_date + (end_date - start_date) / 2
+                middle_date = middle_date.replace(microsecond=0)
+                return (self.search_pulls(middle_date + datetime.timedelta(seconds=1), end_date) +
+                        self.search_pulls(start_date, middle_date))
+
+            if response_json.get('incomplete_results') and self.verbose:
+                print(f'WARNING: Github search timed out, some pull requests created {created} may be missing')
+            items.extend(response_json['items'])
+
+        return items
+
+    def download_user_profiles(self, logins):
+        return download_user_profiles(logins, self.client)
+
+    def get_pulls_graphql(self):
+        import datetime
+        if self.time_window_days is not None:
+            cutoff_date = datetime.datetime.now() - datetime.timedelta(days=self.time_window_days)
+
+        # Pull requests come newest first with their diff metrics, so each request fills up to 100 of them. An
+        # earlier download that stopped part way continues from the page cursor it was checkpointed at
+        pull_requests_list, pages_listed, listed_all, cursor = self.load_checkpoint(with_cursor=True)
+        variables = {'owner': self.owner_name, 'name': self.repo_name, 'first': 100, 'after': cursor}
+        variables.update(self.pull_filter.graphql_variables())
+        another_page = not listed_all
+        while another_page:
+            try:
+                self.check_stopped()
+                data = self.client.graphql(PULL_REQUESTS_QUERY, variables=variables)
+            except BaseException:
+                if self.checkpoint_dir is not None:
+                    self.save_checkpoint(pull_requests_list, None, pages_listed=pages_listed, cursor=variables['after'])
+                raise
+            if data['repository'] is None:
+                raise ValueError('Error 404: No data found at this URL')
+            connection = data['repository']['pullRequests']
+
+            for node in connection['nodes']:
+                if self.time_window_days is not None:
+                    created_at = datetime.datetime.strptime(node['createdAt'], '%Y-%m-%dT%H:%M:%SZ')
+                    if created_at < cutoff_date:
+                        another_page = False
+                        break
+
+                if not self.pull_filter.matches(PullRequestFilter.fields_from_graphql(node)):
+                    continue
+                pull_request_instance = PullRequest(client=self.client)
+                pull_request_instance.fill_from_graphql(node, self.owner_name, self.repo_name)
+                pull_requests_list.append(pull_request_instance)
+
+            if another_page:
+                another_page = connection['pageInfo']['hasNextPage']
+                variables['after'] = connection['pageInfo']['endCursor']
+
+            pages_listed += 1
+            if self.checkpoint_dir is not None and (pages_listed % self.checkpoint_every == 0 or not another_page):
+                self.save_checkpoint(pull_requests_list, None, pages_listed=pages_listed, listed_all=not another_page,
+                                     cursor=variables['after'])
+
+            if self.verbose:
+                print(f'Downloaded {len(pull_requests_list)} pull requests...')
+
+        # Store the pull requests column by column, they are read back through light row views
+        self.pull_requests = self.make_pull_request_table(pull_requests_list)
+
+    def get_pulls_incremental(self, sync_state):
+        import datetime
+
+        # List pull requests by update time and stop at the first one that hasn't changed since the last sync
+        url = f"{self.client.api_url}/repos/{self.owner_name}/{self.repo_name}/pulls"
+        changed_json = self.client.get(url=url, params={'state': 'all', 'sort': 'updated', 'direction': 'desc',
+                                                        'per_page': '100'},
+                                       updated_since=sync_state['updated_at'])
+
+        # Old pull requests that were only commented on are outside the time window, don't download their details
+        cutoff = None
+        if self.time_window_days is not None:
+            cutoff = (datetime.datetime.now() - datetime.timedelta(days=self.time_window_days)).strftime(
+                '%Y-%m-%dT%H:%M:%SZ')
+            changed_json = [json_record for json_record in changed_json if json_record['created_at'] >= cutoff]
         if self.verbose:
-            print(f'Found {len(pulls_json)} pull requests in this time window. Downloading detailed data...')
+            print(f'Found {len(changed_json)} pull requests changed since the last sync. Downloading detailed data...')
+
+        # Start from the saved pull requests and replace the ones that changed
+        pulls_by_number = dict()
+        for record in sync_state['pull_requests']:
+            pull_request_instance = PullRequest(client=self.client)
+            pull_request_instance.fill_from_dict(record)
+            pulls_by_number[pull_request_instance.number] = pull_request_instance
+
+        changed_list = list()
+        for json_record in changed_json:
+            pull_request_instance = PullRequest(client=self.client)
+            pull_request_instance.fill_from_json(json_record, get_details=False)
+            changed_list.append(pull_request_instance)
+            pulls_by_number[pull_request_instance.number] = pull_request_instance
+
+        self.failed_pulls = tuple(self.hydrate_pulls(changed_list))
+
+        # Keep the time window and the newest first order of a full download
+        pull_requests_list = list(pulls_by_number.values())
+        if cutoff is not None:
+            pull_requests_list = [pull for pull in pull_requests_list if pull.created_at >= cutoff]
+        pull_requests_list.sort(key=lambda pull: pull.created_at, reverse=True)
+
+        # Contributor profiles from the last sync don't need to be downloaded again until the cache's TTL runs out
+        self.user_cache.restore({record['name']: record for record in sync_state['users']})
+
+        # Store the pull requests column by column, they are read back through light row views
+        self.pull_requests = self.make_pull_request_table(pull_requests_list)
+
+    def get_pulls_from_store(self):
+        import datetime
+        created_since = None
+        if self.time_window_days is not None:
+            created_since = (datetime.datetime.now() - datetime.timedelta(days=self.time_window_days)).strftime(
+                '%Y-%m-%dT%H:%M:%SZ')
 
-        # Temporarily create an empty list
         pull_requests_list = list()
+        for record in self.store.load_pull_requests(self.owner_name, self.repo_name, created_since=created_since):
+            if not self.pull_filter.matches(PullRequestFilter.fields_from_dict(record)):
+                continue
+            pull_request_instance = PullRequest(client=self.client)
+            pull_request_instance.fill_from_dict(record)
+            pull_requests_list.append(pull_request_instance)
 
-        # Convert each pull request in the json to a PullRequest object and add it
-        # to the list of pull requests stored in this Repository object
+        # Profiles of the contributors are loaded from the store as well
+        for record in self.store.load_users(self.owner_name, self.repo_name):
+            self._known_users[record['name']] = record
+
+        if self.verbose:
+            print(f'Loaded {len(pull_requests_list)} pull requests from {self.store.db_path}')
+
+        # Store the pull requests column by column, they are read back through light row views
+        self.pull_requests = self.make_pull_request_table(pull_requests_list)
+
+    def check_stopped(self, futures=()):
+        # Downloads of a pool that have not started yet are dropped, the running ones finish when the pool is closed
+        if self.stop_event is not None and self.stop_event.is_set():
+            for future in futures:
+                future.cancel()
+            raise InterruptedError(f'Download of {self.owner_name}/{self.repo_name} was stopped')
+
+    def get_checkpoint_path(self):
+        return os.path.join(self.checkpoint_dir, f'{self.owner_name}-{self.repo_name}.checkpoint.json')
+
+    def get_checkpoint_key(self):
+        # A checkpoint is only resumed by the same download, another time window or filter lists other pull requests
+        return {'engine': self.engine, 'time_window_days': self.time_window_days,
+                'pull_filter': self.pull_filter.to_dict()}
+
+    def load_checkpoint(self, with_cursor=False):
+        import json
+        # Returns the pull requests listed so far, how many pages that took and whether the listing was finished.
+        # Profiles in the checkpoint are added to the known users
+        nothing = (list(), 0, False, None) if with_cursor else (list(), 0, False)
+        if self.checkpoint_dir is None or not os.path.exists(self.get_checkpoint_path()):
+            return nothing
+
+        try:
+            with open(self.get_checkpoint_path()) as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            # A damaged checkpoint just means starting over
+            return nothing
+        if checkpoint['key'] != self.get_checkpoint_key():
+            return nothing
+
+        pull_requests_list = list()
+        for record in checkpoint['pull_requests']:
+            pull_request_instance = PullRequest(client=self.client)
+            pull_request_instance.fill_from_dict(record)
+            pull_requests_list.append(pull_request_instance)
+        self.user_cache.restore(checkpoint['users'])
+
+        if self.verbose:
+            n_downloaded = sum(1 for pull in pull_requests_list if pull.num_commits is not None)
+            print(f'Resuming from a checkpoint with {len(pull_requests_list)} pull requests listed, {n_downloaded} '
+                  f'downloaded and {len(checkpoint["users"])} contributor profiles')
+
+        if with_cursor:
+            return pull_requests_list, checkpoint['pages_listed'], checkpoint['listed_all'], checkpoint['cursor']
+        return pull_requests_list, checkpoint['pages_listed'], checkpoint['listed_all']
+
+    def save_checkpoint(self, pull_requests_list, users, pages_listed, listed_all=False, cursor=None):
+        import json
+        if len(pull_requests_list) == 0:
+            # Nothing was listed yet, there is nothing to resume from
+            return
+        if users is None:
+            # The cached profiles of the contributors listed so far, with the time each was downloaded
+            users = self.user_cache.export(pull.user for pull in pull_requests_list)
+
+        checkpoint = {'key': self.get_checkpoint_key(),
+                      'pages_listed': pages_listed,
+                      'listed_all': listed_all,
+                      'cursor': cursor,
+                      'pull_requests': [pull.to_sync_dict() for pull in pull_requests_list],
+                      'users': users}
+
+        if not os.path.exists(self.checkpoint_dir):
+            os.makedirs(self.checkpoint_dir)
+
+        # Write to a temporary file first so an interrupted save doesn't damage the last checkpoint
+        temp_path = self.get_checkpoint_path() + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(temp_path, self.get_checkpoint_path())
+
+    def get_sync_path(self):
+        return os.path.join(self.sync_dir, f'{self.owner_name}-{self.repo_name}.json')
+
+    def load_sync_state(self):
+        import json
+        if self.sync_dir is None or not os.path.exists(self.get_sync_path()):
+            return None
+
+        try:
+            with open(self.get_sync_path()) as f:
+                sync_state = json.load(f)
+        except (OSError, ValueError):
+            # A damaged sync file just means a full download
+            return None
+
+        # The last sync can only be reused if it covers the whole time window asked for now
+        if sync_state['time_window_days'] is not None:
+            if self.time_window_days is None or self.time_window_days > sync_state['time_window_days']:
+                return None
+
+        return sync_state
+
+    def save_sync_state(self):
+        import datetime
+        import json
+
+        # Profiles are saved with the time they were downloaded, so restoring them doesn't reset their TTL
+        downloaded_at = {login: record['downloaded_at'] for login, record in
+                         self.user_cache.export(user.name for user in self.users).items()}
+
+        # The high-water mark is the newest update seen. Pull requests that could not be downloaded are left
+        # before it, so the next sync lists them again
+        updated_at = max((pull.updated_at for pull in self.pull_requests), default=None)
+        failed_updates = [pull.updated_at for pull, e in self.failed_pulls]
+        if len(failed_updates) > 0:
+            earliest_failure = datetime.datetime.strptime(min(failed_updates), '%Y-%m-%dT%H:%M:%SZ')
+            updated_at = (earliest_failure - datetime.timedelta(seconds=1)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        if updated_at is None:
+            # Nothing was found in the window yet, there is nothing to sync from
+            return
+
+        sync_state = {'owner_name': self.owner_name,
+                      'repo_name': self.repo_name,
+                      'time_window_days': self.time_window_days,
+                      'updated_at': updated_at,
+                      'pull_requests': [pull.to_sync_dict() for pull in self.pull_requests],
+                      'users': [dict(user, downloaded_at=downloaded_at.get(user['name'], 0))
+                                for user in self.users_to_json()]}
+
+        if not os.path.exists(self.sync_dir):
+            os.makedirs(self.sync_dir)
+
+        # Write to a temporary file first so an interrupted save doesn't damage the last sync
+        temp_path = self.get_sync_path() + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(sync_state, f)
+        os.replace(temp_path, self.get_sync_path())
+
+    def hydrate_pulls(self, pull_requests_list):
+        import concurrent.futures
+
+        # Download diff metrics using a bounded pool of worker threads. The pull request objects are filled in place,
+        # so the original order of the list is kept no matter which download finishes first
+        failed = list()
         finished = 0
-        total = len(pulls_json)
-        tics = list(range(0, 100, 10))
-        for json_record in pulls_json:
+        total = len(pull_requests_list)
+        tics = list(range(0, 70, 10))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+            futures = {executor.submit(pull.get_diff_metrics): pull for pull in pull_requests_list}
+            for future in concurrent.futures.as_completed(futures):
+                self.check_stopped(futures)
+                # A single failed download should not stop the rest of the batch
+                try:
+                    future.result()
+                except Exception as e:
+                    failed.append((futures[future], e))
+
+                finished += 1
+                if self.verbose:
+                    # Testing showed that downloading pull request data takes ~70% of time, downloading user data
+                    # takes ~30% of the total time
+                    print_progress(int(((finished * .7) / total) * 100), tics)
+
+        return self.check_failed_pulls(failed, total)
+
+    def check_failed_pulls(self, failed, total):
+        if len(failed) > 0:
+            # If nothing could be downloaded there is likely a problem with the connection or the token
+            if len(failed) == total:
+                raise failed[0][1]
             if self.verbose:
-                progress = int(((
-                                            finished * .7) / total) * 100)  # Testing showed that downloading pull request data takes ~70% of time, downloading user data takes ~30% of the total time
-                if progress >= tics[0]:
-                    progress = tics.pop(0)
-                    print('[' + '#' * (progress // 5) + '-' * ((100 - progress) // 5) + '] ' + str(progress) + '%')
-
-            pull_request_instance = PullRequest(token=self.__token)
-            pull_request_instance.fill_from_json(json_record)
-            pull_requests_list.append(pull_request_instance)
-            finished += 1
+                print(f'WARNING: Could not download detailed data for {len(failed)} of {total} pull requests')
 
-        # Convert list to tuple so it's safer from accidental changes
-        self.pull_requests = tuple(pull_requests_list)
+        return failed
 
     def pull_requests_to_json(self):
+        self.ensure_diff_metrics()
         output_list = list()
         for pull_request in self.pull_requests:
             output_list.append(pull_request.to_dict())
 
         return output_list
 
-    def pull_requests_to_pandas(self):
-        import pandas as pd
-        return pd.DataFrame(self.pull_requests_to_json())
+    def pull_requests_to_pandas(self, columns=None):
+        # Diff metrics of a lazy repository are only downloaded when one of their columns is asked for
+        if columns is None or len(set(columns) & set(DIFF_METRIC_COLUMNS)) > 0:
+            self.ensure_diff_metrics()
+        # Typed columns straight from the table, timestamps are datetime64 and state and user are categorical
+        return self.pull_requests.to_pandas(columns)
 
     def get_users_as_json(self, username):
         # GitHub API endpoint for pull requests
-        url = f"https://api.github.com/users/{username}"
+        url = f"{self.client.api_url}/users/{username}"
 
-        users_json = get_github_api_request(url=url, convert_json=True, token=self.__token)
+        users_json = self.client.get(url=url, convert_json=True)
 
         return users_json
 
     def get_users(self, token=None):
-        # Temporarily create an empty list
-        user_list = list()
-        user_names = list()
-
-        # iterate across pull requests
-        finished = 0
-        start = len(self.pull_requests) * .7
-        total = len(self.pull_requests)
-        tics = list(range(70, 120, 10))
+        # Count contributions per user with a dictionary, which also keeps the order users were first seen in
+        contributions = dict()
         for pull in self.pull_requests:
-            if self.verbose:
-                progress = int(((start + finished * .3) / total) * 100)
-                if progress >= tics[0]:
-                    progress = tics.pop(0)
-                    print('[' + '#' * (progress // 5) + '-' * ((100 - progress) // 5) + '] ' + str(progress) + '%')
-
-            # check if name in user list
-
-            if pull.user not in user_names:
-                # Get pull requests from github in json format
-                user_json = self.get_users_as_json(pull.user)
-
-                # Convert each user to a user object and add it
-                # to the list of users stored in this Repository object
-                user_instance = User(name=pull.user, token=self.__token)
-                user_instance.fill_from_json(user_json)
-                user_list.append(user_instance)
-                user_names.append(pull.user)
+            contributions[pull.user] = contributions.get(pull.user, 0) + 1
 
+        user_list = list()
+        new_users = list()
+        waiting_users = list()
+        for name, count in contributions.items():
+            user_instance = User(name=name, client=self.client)
+            user_instance.contributions = count
+            user_list.append(user_instance)
+            record = self._known_users.get(name) or self.user_cache.get(name, wait=False)
+            if record is not None:
+                user_instance.fill_from_dict(record)
+            elif self.engine == 'store' or self.user_cache.claim(name):
+                new_users.append(user_instance)
             else:
-                # otherwise add another contribution tally to the user
-                existing_user_index = user_names.index(pull.user)
-                user_list[existing_user_index].contributions += 1
+                # Another repository sharing the cache is downloading this profile
+                waiting_users.append(user_instance)
+
+        # Download the profile of every contributor that isn't known yet. Data loaded from a store stays offline
+        if self.engine != 'store':
+            try:
+                self.fill_users(new_users)
+                self.user_cache.update({user.name: user.to_dict() for user in new_users})
+            finally:
+                self.user_cache.release([user.name for user in new_users])
+
+            # Only wait for the other repositories once this one holds no claims, and download what they could not
+            missing_users = list()
+            for user_instance in waiting_users:
+                record = self.user_cache.get(user_instance.name)
+                if record is None:
+                    missing_users.append(user_instance)
+                else:
+                    user_instance.fill_from_dict(record)
+            if len(missing_users) > 0:
+                self.fill_users(missing_users)
+            self.user_cache.save()
+
+        # Store the users column by column, they are read back through light row views
+        self.users = UserTable(user_list, client=self.client)
 
-            finished += 1
+    def fill_users(self, user_list):
+        import concurrent.futures
 
-        # Convert list to tuple so it's safer from accidental changes
-        self.users = tuple(user_list)
+        finished = 0
+        total = len(user_list)
+        tics = list(range(70, 110, 10))
+
+        # GraphQL resolves up to 100 users per request, the rest (bots, or no token) fall back to one REST call each
+        remaining = list()
+        if self.client.has_token:
+            for i in range(0, total, USERS_BATCH_SIZE):
+                self.check_stopped()
+                batch = user_list[i:i + USERS_BATCH_SIZE]
+                missing = self.fill_users_graphql(batch)
+                remaining.extend(missing)
+                finished += len(batch) - len(missing)
+                if self.verbose:
+                    print_progress(int(70 + (finished / total) * 30), tics)
+        else:
+            remaining = user_list
+
+        if len(remaining) > 0:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+                futures = {executor.submit(self.get_users_as_json, user.name): user for user in remaining}
+                for future in concurrent.futures.as_completed(futures):
+                    self.check_stopped(futures)
+                    futures[future].fill_from_json(future.result())
+                    finished += 1
+                    if self.verbose:
+                        print_progress(int(70 + (finished / total) * 30), tics)
 
         if self.verbose:
-            if 100 in tics:
-                progress = 100
-                print('[' + '#' * (progress // 5) + '-' * ((100 - progress) // 5) + '] ' + str(progress) + '%')
+            print_progress(100, tics)
+
+    def fill_users_graphql(self, user_list):
+        return fill_users_graphql(user_list, self.client)
 
     def users_to_json(self):
         output_list = list()
@@ -308,8 +1038,7 @@ class Repository:
         return output_list
 
     def users_to_pandas(self):
-        import pandas as pd
-        return pd.DataFrame(self.users_to_json())
+        return self.users.to_pandas()
 
     def total_user(self):
         total_users_set = set()
@@ -370,84 +1099,58 @@ class Repository:
                 'n_users': len(self.users)}
 
     def to_csv_header(self):
-        import csv
-        import io
-        csv_output = io.StringIO()
-        # Create a CSV writer
-        csv_writer = csv.writer(csv_output, dialect='excel')
-
-        # Write a single row that could be the headers
-        csv_writer.writerow(['owner_name', 'repo_name', 'n_pull_requests', 'n_users'])
-
-        # Get the CSV-formatted string from the virtual file
-        csv_string = csv_output.getvalue().encode('ascii', 'ignore').decode('ascii')
-        csv_output.close()
-
-        return csv_string
+        return to_csv_string(self.csv_columns)
 
     def to_csv_record(self):
-        import csv
-        import io
-        csv_output = io.StringIO()
-        # Create a CSV writer
-        csv_writer = csv.writer(csv_output, dialect='excel')
+        return to_csv_string(self.to_csv_row())
 
-        # Write a single row that could be the headers
-        csv_writer.writerow([self.owner_name, self.repo_name, len(self.pull_requests), len(self.users)])
-
-        # Get the CSV-formatted string from the virtual file
-        csv_string = csv_output.getvalue().encode('ascii', 'ignore').decode('ascii')
-
-        csv_output.close()
-
-        return csv_string
+    def to_csv_row(self):
+        return [self.owner_name, self.repo_name, len(self.pull_requests), len(self.users)]
 
     def save_to_csv(self):
+        self.ensure_diff_metrics()
         # Save to repositories.csv
         save_as_csv('repositories.csv', self)
 
         # Save to repos/owner-repo.csv
         repo_csv_path = os.path.join('repos', f'{self.owner_name}-{self.repo_name}.csv')
-        save_as_csv(repo_csv_path, self)
+        save_many_as_csv(repo_csv_path, self.pull_requests)
+
+    def save_to_parquet(self, file_name, compression='zstd'):
+        self.ensure_diff_metrics()
+        save_as_parquet(file_name, self.pull_requests, compression=compression)
 
     def box_closed_open_commit(self):
-        import pandas as pd
         if len(self.pull_requests) > 0:
-            temp_dict = {'commit': [], 'state': []}
-            for pull in self.pull_requests:
-                temp_dict['state'].append(pull.state)
-                temp_dict['commit'].append(pull.num_commits)
-            df = pd.DataFrame(temp_dict).dropna()
+            df = self.pull_requests_to_pandas(['num_commits', 'state'])
+            df = df.rename(columns={'num_commits': 'commit'}).dropna()
             ax = df.plot.box(by="state", return_type='axes', showfliers=False)
+            if self.sampled:
+                ax['commit'].figure.suptitle(self.describe_sample(['num_commits']), y=1.0, va='bottom',
+                                             fontsize='small')
             ax['commit'].figure.savefig(self.output_filepath + 'box_closed_open_commit.png', bbox_inches='tight')
 
         else:
             print('No pull requests found')
 
     def box_addition_deletion(self):
-        import pandas as pd
         if len(self.pull_requests) > 0:
-            temp_dict = {'addition': [], 'deletion': [], 'state': []}
-            for pull in self.pull_requests:
-                temp_dict['state'].append(pull.state)
-                temp_dict['addition'].append(pull.num_additions)
-                temp_dict['deletion'].append(pull.num_deletions)
-            df = pd.DataFrame(temp_dict).dropna()
+            df = self.pull_requests_to_pandas(['num_additions', 'num_deletions', 'state'])
+            df = df.rename(columns={'num_additions': 'addition', 'num_deletions': 'deletion'}).dropna()
             ax = df.plot.box(by="state", return_type='axes', showfliers=False)
+            if self.sampled:
+                ax['addition'].figure.suptitle(self.describe_sample(['num_additions', 'num_deletions']), y=1.0,
+                                               va='bottom', fontsize='small')
             ax['addition'].figure.savefig(self.output_filepath + 'box_addition_deletion.png', bbox_inches='tight')
 
         else:
             print('No pull requests found')
 
     def scatter_addition_deletion(self):
-        import pandas as pd
         import matplotlib.pyplot as plt
         if len(self.pull_requests) > 0:
-            temp_dict = {'addition': [], 'deletion': []}
-            for pull in self.pull_requests:
-                temp_dict['addition'].append(pull.num_additions)
-                temp_dict['deletion'].append(pull.num_deletions)
-            df = pd.DataFrame(temp_dict)
+            df = self.pull_requests_to_pandas(['num_additions', 'num_deletions'])
+            df = df.rename(columns={'num_additions': 'addition', 'num_deletions': 'deletion'})
             # Remove data that is more than 3 standard deviations from the mean
             additions_extreme_threshold = df['addition'].mean() + df['addition'].std() * 3
             deletions_extreme_threshold = df['deletion'].mean() + df['deletion'].std() * 3
@@ -455,6 +1158,11 @@ class Repository:
             df = df[df['deletion'] <= deletions_extreme_threshold]
             df = df.dropna()
             scatterplot = df.plot.scatter(x='addition', y='deletion')
+            if self.sampled:
+                estimate = self.estimate_correlations(['num_additions', 'num_deletions']).iloc[0]
+                scatterplot.set_title(f"Sample of {int(estimate['n'])} of {len(self.pull_requests)} pull requests, "
+                                      f"correlation {estimate['estimate']:.2f} "
+                                      f"[{estimate['lower']:.2f}, {estimate['upper']:.2f}]", fontsize='small')
             scatterplot.figure.savefig(self.output_filepath + 'scatter_addition_deletion.png', bbox_inches='tight')
 
         else:
@@ -462,27 +1170,98 @@ class Repository:
 
     def pull_request_correlations(self):
         if len(self.pull_requests) > 0:
-            # convert user data to a dataframe
-            df = self.pull_requests_to_pandas()
-
             # grab the four pull request fields we need to run pairwise correlation
-            corr_subset = df[['num_commits', 'num_additions', 'num_deletions', 'num_changed_files']]
+            corr_subset = self.pull_requests_to_pandas(['num_commits', 'num_additions', 'num_deletions',
+                                                        'num_changed_files'])
 
             # calculate pairwise correlations between fields
             correlations = corr_subset.corr()
+
+            # A sample only gives estimates, show how far off they could be
+            if self.sampled:
+                intervals = self.estimate_correlations(list(DIFF_METRIC_COLUMNS))
+                print(f"Estimated from a stratified sample of {int(intervals['n'].min())} of "
+                      f"{len(self.pull_requests)} pull requests, with 95% confidence intervals:")
+                print(intervals.round(3))
         else:
             print('No pull requests found')
             correlations = None
 
         return correlations
 
+    def estimate_mean(self, column, by=None, confidence=0.95):
+        import math
+        import statistics
+        import pandas as pd
+        # Stratified estimate of the mean of a diff metric, for each value of by (like 'state') when given. Every
+        # group the sample was drawn from is weighted by how many pull requests it has, and the confidence interval
+        # shrinks to the estimate as the sample covers the whole group
+        df = self.pull_requests_to_pandas(['state', 'created_at', column])
+        level = len(next(iter(self.sample_strata))) if self.sample_strata else 2
+        stratum = {index: key for key, indices in self.get_sample_strata(level).items() for index in indices}
+        df['stratum'] = [str(stratum[index]) for index in range(len(df))]
+        groups = [('all', df)] if by is None else df.groupby(by, observed=True)
+        z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+
+        rows = dict()
+        for name, group in groups:
+            # size counts every listed pull request, count only the ones with diff metrics
+            strata = group.groupby('stratum')[column].agg(['size', 'count', 'mean', 'var'])
+            missing = strata[strata['count'] == 0]
+            strata = strata[strata['count'] > 0]
+            if len(strata) == 0:
+                continue
+            if len(missing) > 0 and self.verbose:
+                print(f'WARNING: {len(missing)} of {len(missing) + len(strata)} groups of {name} have no {column} '
+                      f'values, the estimate only covers the other {int(strata["size"].sum())} pull requests')
+            weights = strata['size'] / strata['size'].sum()
+            estimate = (weights * strata['mean']).sum()
+            # A fully covered group adds no uncertainty. One with a single value has an unknown variance, which
+            # makes the interval unknown too
+            finite_population = 1 - strata['count'] / strata['size']
+            terms = weights ** 2 * finite_population * strata['var'] / strata['count']
+            terms = terms.where(finite_population > 0, 0)
+            margin = z * math.sqrt(terms.sum(skipna=False))
+            rows[name] = {'estimate': estimate, 'lower': estimate - margin, 'upper': estimate + margin,
+                          'n': int(strata['count'].sum()), 'N': len(group)}
+
+        return pd.DataFrame.from_dict(rows, orient='index')
+
+    def estimate_correlations(self, columns, confidence=0.95):
+        import math
+        import statistics
+        import pandas as pd
+        # Pairwise correlations of diff metrics with confidence intervals from the Fisher transformation
+        df = self.pull_requests_to_pandas(columns).dropna()
+        correlations = df.corr()
+        z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+
+        rows = list()
+        for i, x in enumerate(columns):
+            for y in columns[i + 1:]:
+                r = correlations.loc[x, y]
+                lower, upper = r, r
+                if len(df) > 3 and abs(r) < 1:
+                    margin = z / math.sqrt(len(df) - 3)
+                    lower, upper = math.tanh(math.atanh(r) - margin), math.tanh(math.atanh(r) + margin)
+                rows.append({'x': x, 'y': y, 'estimate': r, 'lower': lower, 'upper': upper, 'n': len(df)})
+
+        return pd.DataFrame(rows).set_index(['x', 'y'])
+
+    def describe_sample(self, columns):
+        # Text for figures of sampled repositories, with the estimated mean of each column per state
+        lines = [f'Sample of {len(self.pull_requests_to_pandas(columns).dropna())} of {len(self.pull_requests)} pull '
+                 f'requests, estimated means with 95% confidence intervals']
+        for column in columns:
+            estimates = self.estimate_mean(column, by='state')
+            lines.append(f'{column}: ' + ', '.join(f"{state} {row['estimate']:.1f} [{row['lower']:.1f}, "
+                                                     f"{row['upper']:.1f}]" for state, row in estimates.iterrows()))
+        return '\n'.join(lines)
+
     def file_changes_per_user(self):
         if len(self.pull_requests) > 0:
-            # convert user data to a dataframe
-            df = self.pull_requests_to_pandas()
-
             # create a subset dataframe with the two fields we need
-            subset = df[['user', 'num_changed_files']]
+            subset = self.pull_requests_to_pandas(['user', 'num_changed_files'])
             # subset = subset.groupby(['user']).sum()
 
             # create a barplot with the
@@ -494,11 +1273,124 @@ class Repository:
             print('No pull requests found')
 
 
+class PullRequestFilter:
+    def __init__(self, authors=None, exclude_authors=None, exclude_bots=False, exclude_drafts=False, labels=None,
+                 exclude_labels=None, base_branches=None, states=None):
+        # Keeps the pull requests that pass every condition. authors, labels (any of them), base_branches and states
+        # are allow lists, None allows everything
+        if states is not None and not set(states) <= {'open', 'closed'}:
+            raise ValueError("states can only contain 'open' and 'closed'")
+        self.authors = set(authors) if authors is not None else None
+        self.exclude_authors = set(exclude_authors or tuple())
+        self.exclude_bots = exclude_bots
+        self.exclude_drafts = exclude_drafts
+        self.labels = set(labels) if labels is not None else None
+        self.exclude_labels = set(exclude_labels or tuple())
+        self.base_branches = set(base_branches) if base_branches is not None else None
+        self.states = set(states) if states is not None else None
+
+    def to_dict(self):
+        # Sets are sorted, so the same filter always gives the same dictionary
+        return {name: sorted(value) if isinstance(value, set) else value for name, value in vars(self).items()}
+
+    @property
+    def active(self):
+        return (self.authors is not None or len(self.exclude_authors) > 0 or self.exclude_bots or self.exclude_drafts
+                or self.labels is not None or len(self.exclude_labels) > 0 or self.base_branches is not None
+                or self.states is not None)
+
+    @staticmethod
+    def fields_from_json(json):
+        # Fields of a REST list record or a search result. Search results have no base branch
+        login = json['user']['login'] if json.get('user') is not None else 'ghost'
+        is_bot = json.get('user') is not None and json['user'].get('type') == 'Bot'
+        return {'user': login, 'is_bot': is_bot or login.endswith('[bot]'), 'draft': json.get('draft'),
+                'labels': [label['name'] for label in json['labels']] if 'labels' in json else None,
+                'base': json['base']['ref'] if 'base' in json else None, 'state': json['state']}
+
+    @staticmethod
+    def fields_from_graphql(node):
+        # GraphQL gives bot logins without the [bot] suffix, but tells them apart by their type
+        author = node['author'] or {'login': 'ghost'}
+        is_bot = author.get('__typename') == 'Bot' or author['login'].endswith('[bot]')
+        labels = [label['name'] for label in node['labels']['nodes']] if node.get('labels') else None
+        return {'user': author['login'], 'is_bot': is_bot, 'draft': node.get('isDraft'), 'labels': labels,
+                'base': node.get('baseRefName'), 'state': 'open' if node['state'] == 'OPEN' else 'closed'}
+
+    @staticmethod
+    def fields_from_dict(record):
+        # Saved pull requests only keep the author and state, the other conditions can't be checked
+        return {'user': record['user'], 'is_bot': record['user'].endswith('[bot]'), 'draft': None, 'labels': None,
+                'base': None, 'state': record['state']}
+
+    def matches(self, fields):
+        # A field that is None is unknown for this source and lets the pull request through
+        if self.states is not None and fields['state'] not in self.states:
+            return False
+        if self.authors is not None and fields['user'] not in self.authors:
+            return False
+        if fields['user'] in self.exclude_authors or (self.exclude_bots and fields['is_bot']):
+            return False
+        if self.exclude_drafts and fields['draft']:
+            return False
+        if fields['labels'] is not None:
+            if self.labels is not None and len(self.labels.intersection(fields['labels'])) == 0:
+                return False
+            if len(self.exclude_labels.intersection(fields['labels'])) > 0:
+                return False
+        if fields['base'] is not None and self.base_branches is not None and fields['base'] not in self.base_branches:
+            return False
+        return True
+
+    def rest_params(self):
+        # The pulls endpoint can filter on a single state and a single base branch itself
+        params = dict()
+        if self.states is not None and len(self.states) == 1:
+            params['state'] = list(self.states)[0]
+        if self.base_branches is not None and len(self.base_branches) == 1:
+            params['base'] = list(self.base_branches)[0]
+        return params
+
+    def search_qualifiers(self):
+        # Search qualifiers for every condition the search API understands
+        def quote(value):
+            return f'"{value}"' if ' ' in value else value
+
+        qualifiers = list()
+        if self.states is not None and len(self.states) == 1:
+            qualifiers.append(f'is:{list(self.states)[0]}')
+        if self.authors is not None and len(self.authors) == 1:
+            qualifiers.append(f'author:{list(self.authors)[0]}')
+        qualifiers.extend(f'-author:{author}' for author in sorted(self.exclude_authors))
+        if self.exclude_drafts:
+            qualifiers.append('draft:false')
+        if self.labels is not None:
+            # Labels separated by commas match pull requests with any of them
+            qualifiers.append('label:' + ','.join(quote(label) for label in sorted(self.labels)))
+        qualifiers.extend(f'-label:{quote(label)}' for label in sorted(self.exclude_labels))
+        if self.base_branches is not None and len(self.base_branches) == 1:
+            qualifiers.append(f'base:{list(self.base_branches)[0]}')
+        return ' '.join(qualifiers)
+
+    def graphql_variables(self):
+        # Arguments of the pullRequests connection, None means no filter
+        states = None
+        if self.states is not None:
+            states = sorted(set(state for name in self.states for state in
+                                (['OPEN'] if name == 'open' else ['CLOSED', 'MERGED'])))
+        base = list(self.base_branches)[0] if self.base_branches is not None and len(self.base_branches) == 1 else None
+        return {'states': states, 'labels': sorted(self.labels) if self.labels is not None else None,
+                'baseRefName': base}
+
+
 class PullRequest:
+    csv_columns = ('title', 'number', 'body', 'state', 'created_at', 'closed_at', 'user', 'num_commits',
+                   'num_additions', 'num_deletions', 'num_changed_files')
+
     def __init__(self, title: str = None, number: int = None, body: str = None, state: str = None,
                  created_at: str = None, closed_at: str = None,
                  user: str = None, commits: str = None, additions: str = None, deletions: str = None,
-                 changed_files: str = None, token=None):
+                 changed_files: str = None, token=None, client=None):
         self.title = title
         self.number = number
         self.body = body
@@ -510,22 +1402,95 @@ class PullRequest:
         self.num_additions = additions
         self.num_deletions = deletions
         self.num_changed_files = changed_files
+        self.updated_at = None  # Used to find pull requests that changed since the last sync. Don't need to output
+        self.merged_at = None  # Don't need to output
 
-        self.__token = token  # Store token for making API requests. DO NOT INCLUDE IN OUTPUTS.
+        # Client used for making API requests. It holds the token, DO NOT INCLUDE IN OUTPUTS.
+        if client is None:
+            client = get_default_client(token)
+        self._client = client
 
-    def fill_from_json(self, json):
+    def fill_from_json(self, json, get_details=True):
         self.title = json['title']
         self.number = json['number']
         self.body = json['body']
         self.state = json['state']
         self.created_at = json['created_at']
+        self.updated_at = json['updated_at']
         self.closed_at = json['closed_at']
+        self.merged_at = json.get('merged_at')
         self.user = json['user']['login']
         self.url = json['url']  # Don't need to output
         self.commits_url = json['commits_url']  # Don't need to output
         self.diff_url = json['diff_url']  # Don't need to output
 
-        self.get_diff_metrics()
+        if get_details:
+            self.get_diff_metrics()
+
+    def fill_from_graphql(self, node, owner_name, repo_name):
+        self.title = node['title']
+        self.number = node['number']
+        self.body = node['body']
+        # REST only knows open and closed, merged pull requests are closed ones
+        self.state = 'open' if node['state'] == 'OPEN' else 'closed'
+        self.created_at = node['createdAt']
+        self.updated_at = node['updatedAt']
+        self.closed_at = node['closedAt']
+        self.merged_at = node['mergedAt']
+        # Deleted accounts have no author, REST reports them as the ghost user
+        self.user = node['author']['login'] if node['author'] is not None else 'ghost'
+        self.num_additions = node['additions']
+        self.num_deletions = node['deletions']
+        self.num_changed_files = node['changedFiles']
+        self.num_commits = node['commits']['totalCount']
+
+        # Keep the REST urls so get_diff_metrics still works for these objects
+        self.url = f"{self._client.api_url}/repos/{owner_name}/{repo_name}/pulls/{self.number}"  # Don't need to output
+        self.commits_url = self.url + '/commits'  # Don't need to output
+        self.diff_url = f"https://github.com/{owner_name}/{repo_name}/pull/{self.number}.diff"  # Don't need to output
+
+    def fill_from_search(self, item):
+        self.title = item['title']
+        self.number = item['number']
+        self.body = item['body']
+        self.state = item['state']
+        self.created_at = item['created_at']
+        self.updated_at = item['updated_at']
+        self.closed_at = item['closed_at']
+        self.merged_at = item['pull_request'].get('merged_at')
+        self.user = item['user']['login']
+        # Search results are issues, the pull request urls are kept in the pull_request field
+        self.url = item['pull_request']['url']  # Don't need to output
+        self.commits_url = self.url + '/commits'  # Don't need to output
+        self.diff_url = item['pull_request'].get('diff_url')  # Don't need to output
+
+    def fill_from_dict(self, record):
+        # Restore a pull request that was saved with to_sync_dict
+        self.title = record['title']
+        self.number = record['number']
+        self.body = record['body']
+        self.state = record['state']
+        self.created_at = record['created_at']
+        self.updated_at = record['updated_at']
+        self.closed_at = record['closed_at']
+        self.merged_at = record.get('merged_at')
+        self.user = record['user']
+        self.num_commits = record['num_commits']
+        self.num_additions = record['num_additions']
+        self.num_deletions = record['num_deletions']
+        self.num_changed_files = record['num_changed_files']
+        self.url = record['url']  # Don't need to output
+        self.commits_url = self.url + '/commits'  # Don't need to output
+        self.diff_url = record['diff_url']  # Don't need to output
+
+    def to_sync_dict(self):
+        # Everything needed to restore this pull request without downloading it again
+        record = self.to_dict()
+        record['updated_at'] = self.updated_at
+        record['merged_at'] = self.merged_at
+        record['url'] = self.url
+        record['diff_url'] = self.diff_url
+        return record
 
     def to_dict(self):
         return {'title': self.title,
@@ -543,7 +1508,7 @@ class PullRequest:
 
     def get_diff_metrics(self):
         # Download diff data from API
-        pull_json = get_github_api_request(self.url, token=self.__token)
+        pull_json = self._client.get(self.url)
 
         self.num_additions = pull_json['additions']
         self.num_deletions = pull_json['deletions']
@@ -557,41 +1522,14 @@ class PullRequest:
         return f'PullRequest(number:{self.number}, title:{self.title})'
 
     def to_csv_header(self):
-        import csv
-        import io
-        csv_output = io.StringIO()
-        # Create a CSV writer
-        csv_writer = csv.writer(csv_output, dialect='excel')
-
-        # Write a single row that could be the headers
-        csv_writer.writerow(
-            ['title', 'number', 'body', 'state', 'created_at', 'closed_at', 'user', 'num_commits', 'num_additions',
-             'num_deletions', 'num_changed_files'])
-
-        # Get the CSV-formatted string from the virtual file
-        csv_string = csv_output.getvalue().encode('ascii', 'ignore').decode('ascii')
-
-        csv_output.close()
-
-        return csv_string
+        return to_csv_string(self.csv_columns)
 
     def to_csv_record(self):
-        import csv
-        import io
-        csv_output = io.StringIO()
-        # Create a CSV writer
-        csv_writer = csv.writer(csv_output, dialect='excel')
-
-        # Write a single row that could be the headers
-        csv_writer.writerow([self.title, self.number, self.body, self.state, self.created_at, self.closed_at, self.user,
-                             self.num_commits, self.num_additions, self.num_deletions, self.num_changed_files, ])
-
-        # Get the CSV-formatted string from the virtual file
-        csv_string = csv_output.getvalue().encode('ascii', 'ignore').decode('ascii')
+        return to_csv_string(self.to_csv_row())
 
-        csv_output.close()
-
-        return csv_string
+    def to_csv_row(self):
+        return [self.title, self.number, self.body, self.state, self.created_at, self.closed_at, self.user,
+                self.num_commits, self.num_additions, self.num_deletions, self.num_changed_files]
 
     def save_to_csv(self, owner_name, repo_name):
         # Save to repos/owner-repo.csv
@@ -600,8 +1538,10 @@ class PullRequest:
 
 
 class User:
+    csv_columns = ('name', 'followers', 'following', 'public_repos', 'public_gists', 'contributions')
+
     def __init__(self, name, followers: str = None, following: int = None, public_repos: str = None,
-                 public_gists: str = None, token=None):
+                 public_gists: str = None, token=None, client=None):
         self.name = name
         self.followers = followers
         self.following = following
@@ -609,7 +1549,10 @@ class User:
         self.public_gists = public_gists
         self.contributions = 1
 
-        self.__token = token  # Store token for making API requests. DO NOT INCLUDE IN OUTPUTS.
+        # Client used for making API requests. It holds the token, DO NOT INCLUDE IN OUTPUTS.
+        if client is None:
+            client = get_default_client(token)
+        self._client = client
 
     def fill_from_json(self, json):
         self.followers = json['followers']
@@ -617,6 +1560,19 @@ class User:
         self.public_repos = json['public_repos']
         self.public_gists = json['public_gists']
 
+    def fill_from_dict(self, record):
+        # Restore a user that was saved with to_dict
+        self.followers = record['followers']
+        self.following = record['following']
+        self.public_repos = record['public_repos']
+        self.public_gists = record['public_gists']
+
+    def fill_from_graphql(self, node):
+        self.followers = node['followers']['totalCount']
+        self.following = node['following']['totalCount']
+        self.public_repos = node['repositories']['totalCount']
+        self.public_gists = node['gists']['totalCount']
+
     def to_dict(self):
         return {'name': self.name,
                 'followers': self.followers,
@@ -627,120 +1583,1503 @@ class User:
                 }
 
     def to_csv_header(self):
-        import csv
-        import io
-        csv_output = io.StringIO()
-        # Create a CSV writer
-        csv_writer = csv.writer(csv_output, dialect='excel')
+        return to_csv_string(self.csv_columns)
 
-        # Write a single row that could be the headers
-        csv_writer.writerow(['name', 'followers', 'following', 'public_repos', 'public_gists', 'contributions'])
+    def to_csv_record(self):
+        return to_csv_string(self.to_csv_row())
 
-        # Get the CSV-formatted string from the virtual file
-        csv_string = csv_output.getvalue().encode('ascii', 'ignore').decode('ascii')
+    def to_csv_row(self):
+        return [self.name, self.followers, self.following, self.public_repos, self.public_gists, self.contributions]
 
-        csv_output.close()
+    def save_to_csv(self):
+        save_as_csv('users.csv', self)
 
-        return csv_string
 
-    def to_csv_record(self):
-        import csv
-        import io
-        csv_output = io.StringIO()
-        # Create a CSV writer
-        csv_writer = csv.writer(csv_output, dialect='excel')
+class ColumnarTable:
+    # Maps each column to how it is stored: 'int' int64, 'nullable_int' float64 with NaN for missing values,
+    # 'text' object, 'category' int32 codes into a list of categories, 'timestamp' int64 seconds since 1970 with NaT
+    # for missing values
+    columns = dict()
+    row_class = None
+    # Text columns that can get long and are handled according to text_mode
+    large_text_columns = tuple()
+
+    def __init__(self, records=(), client=None, text_mode='keep', text_max_chars=280, sidecar_path=None):
+        import numpy as np
+        # text_mode is 'keep', 'drop' (store nothing), 'truncate' (keep the first text_max_chars characters), 'intern'
+        # (store repeated texts once) or 'sidecar' (compress them into a file that is read on first access)
+        if text_mode not in ('keep', 'drop', 'truncate', 'intern', 'sidecar'):
+            raise ValueError(f"Unknown text_mode '{text_mode}', use 'keep', 'drop', 'truncate', 'intern' or 'sidecar'")
+        records = list(records)
+        if text_mode == 'sidecar' and sidecar_path is None and len(records) > 0:
+            raise ValueError("text_mode 'sidecar' needs a sidecar_path to write the texts to")
+        self.client = client
+        self.text_mode = text_mode
+        self.text_max_chars = text_max_chars
+        self._length = len(records)
+        self._arrays = dict()
+        self._categories = dict()
+        self._sidecar = TextSidecar(sidecar_path) if text_mode == 'sidecar' and sidecar_path is not None else None
+        self._sidecar_lengths = dict()
+
+        # Fill one column at a time so every value is converted only once
+        for name, kind in self.columns.items():
+            values = [getattr(record, name) for record in records]
+            if kind == 'int':
+                self._arrays[name] = np.array(values, dtype=np.int64)
+            elif kind == 'nullable_int':
+                self._arrays[name] = np.array([np.nan if value is None else value for value in values],
+                                              dtype=np.float64)
+            elif kind == 'text' and name in self.large_text_columns and self._sidecar is not None:
+                # Only the position of each text in the sidecar file is kept in memory
+                self._arrays[name], self._sidecar_lengths[name] = self._sidecar.write(values)
+            elif kind == 'text':
+                if name in self.large_text_columns:
+                    values = self.shrink_texts(values, text_mode, text_max_chars)
+                self._arrays[name] = np.empty(len(values), dtype=object)
+                self._arrays[name][:] = values
+            elif kind == 'category':
+                categories = sorted(set(value for value in values if value is not None))
+                codes = {category: code for code, category in enumerate(categories)}
+                self._categories[name] = categories
+                self._arrays[name] = np.array([-1 if value is None else codes[value] for value in values],
+                                              dtype=np.int32)
+            elif kind == 'timestamp':
+                # numpy reads 'NaT' as a missing timestamp, which is stored as the smallest int64
+                self._arrays[name] = np.array([value.rstrip('Z') if value is not None else 'NaT' for value in values],
+                                              dtype='datetime64[s]').view(np.int64)
+
+    def close(self):
+        # Deletes the sidecar file, texts kept in it can't be read from this table anymore
+        if self._sidecar is not None:
+            self._sidecar.close()
+
+    @staticmethod
+    def shrink_texts(values, text_mode, text_max_chars):
+        if text_mode == 'drop':
+            return [None] * len(values)
+        elif text_mode == 'truncate':
+            return [value[:text_max_chars] if value is not None else None for value in values]
+        elif text_mode == 'intern':
+            # Identical texts, like untouched pull request templates, all point to the same string
+            unique_values = dict()
+            return [unique_values.setdefault(value, value) if value is not None else None for value in values]
+        return values
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('row index out of range')
+        return self.row_class(self, index)
+
+    def __iter__(self):
+        for index in range(self._length):
+            yield self.row_class(self, index)
+
+    def get_value(self, name, index):
+        import numpy as np
+        kind = self.columns[name]
+        value = self._arrays[name][index]
+        if name in self._sidecar_lengths:
+            return self._sidecar.read(value, self._sidecar_lengths[name][index])
+        elif kind == 'int':
+            return int(value)
+        elif kind == 'nullable_int':
+            return None if np.isnan(value) else int(value)
+        elif kind == 'category':
+            return None if value < 0 else self._categories[name][value]
+        elif kind == 'timestamp':
+            if value == np.iinfo(np.int64).min:
+                return None
+            return np.datetime_as_string(np.int64(value).astype('datetime64[s]'), unit='s') + 'Z'
+        return value
+
+    def set_value(self, name, index, value):
+        import numpy as np
+        kind = self.columns[name]
+        if name in self._sidecar_lengths:
+            offsets, lengths = self._sidecar.write([value])
+            self._arrays[name][index] = offsets[0]
+            self._sidecar_lengths[name][index] = lengths[0]
+            return
+        if kind == 'text' and name in self.large_text_columns:
+            value = self.shrink_texts([value], self.text_mode, self.text_max_chars)[0]
+        if kind == 'nullable_int':
+            value = np.nan if value is None else value
+        elif kind == 'category':
+            if value is None:
+                value = -1
+            else:
+                if value not in self._categories[name]:
+                    self._categories[name].append(value)
+                value = self._categories[name].index(value)
+        elif kind == 'timestamp':
+            value = np.datetime64(value.rstrip('Z') if value is not None else 'NaT', 's').view(np.int64)
+        self._arrays[name][index] = value
+
+    def to_numpy(self, name):
+        import numpy as np
+        # The stored array itself, timestamps are given as datetime64 without copying
+        if name in self._sidecar_lengths:
+            # Texts kept in a sidecar file have to be read back
+            texts = np.empty(self._length, dtype=object)
+            texts[:] = [self.get_value(name, index) for index in range(self._length)]
+            return texts
+        if self.columns[name] == 'timestamp':
+            return self._arrays[name].view('datetime64[s]')
+        return self._arrays[name]
+
+    def to_pandas(self, columns=None):
+        import pandas as pd
+        # Asking only for the columns an analysis needs keeps the text out of numeric work
+        if columns is None:
+            columns = list(self.columns)
+
+        data = dict()
+        for name in columns:
+            kind = self.columns[name]
+            if kind == 'category':
+                data[name] = pd.Categorical.from_codes(self._arrays[name], categories=self._categories[name])
+            else:
+                data[name] = self.to_numpy(name)
+
+        # Numeric and timestamp columns share memory with the table
+        return pd.DataFrame(data, copy=False)
+
+    def to_arrow(self, columns=None):
+        import numpy as np
+        import pyarrow as pa
+        if columns is None:
+            columns = list(self.columns)
+
+        # Every column gets an explicit type, missing values become nulls instead of NaN or sentinels
+        arrays = list()
+        for name in columns:
+            kind = self.columns[name]
+            values = self._arrays[name]
+            if name in self._sidecar_lengths or kind == 'text':
+                arrays.append(pa.array(self.to_numpy(name), type=pa.string()))
+            elif kind == 'int':
+                arrays.append(pa.array(values, type=pa.int64()))
+            elif kind == 'nullable_int':
+                missing = np.isnan(values)
+                arrays.append(pa.array(np.where(missing, 0, values).astype(np.int64), mask=missing))
+            elif kind == 'category':
+                codes = pa.array(values, type=pa.int32(), mask=values < 0)
+                arrays.append(pa.DictionaryArray.from_arrays(codes, pa.array(self._categories[name], type=pa.string())))
+            elif kind == 'timestamp':
+                missing = values == np.iinfo(np.int64).min
+                seconds = pa.array(np.where(missing, 0, values), type=pa.int64(), mask=missing)
+                arrays.append(seconds.cast(pa.timestamp('s', tz='UTC')))
+
+        return pa.Table.from_arrays(arrays, names=list(columns))
+
+
+class TextSidecar:
+    def __init__(self, path):
+        # Texts are compressed one by one and appended to a file, so each can be read back on its own
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+        open(self.path, 'wb').close()
+
+    def write(self, values):
+        import numpy as np
+        import zlib
+        offsets = np.full(len(values), -1, dtype=np.int64)
+        lengths = np.zeros(len(values), dtype=np.int64)
+        with self._lock:
+            with open(self.path, 'ab') as f:
+                for i, value in enumerate(values):
+                    if value is not None:
+                        data = zlib.compress(value.encode('utf-8'))
+                        offsets[i] = f.tell()
+                        lengths[i] = len(data)
+                        f.write(data)
+
+        return offsets, lengths
+
+    def read(self, offset, length):
+        import zlib
+        if offset < 0:
+            return None
+
+        with self._lock:
+            # The file is only opened the first time a text is needed
+            if self._file is None:
+                self._file = open(self.path, 'rb')
+            self._file.seek(offset)
+            data = self._file.read(length)
+
+        return zlib.decompress(data).decode('utf-8')
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+class PullRequestTable(ColumnarTable):
+    columns = {'number': 'int', 'title': 'text', 'body': 'text', 'state': 'category', 'created_at': 'timestamp',
+               'updated_at': 'timestamp', 'closed_at': 'timestamp', 'merged_at': 'timestamp', 'user': 'category',
+               'num_commits': 'nullable_int', 'num_additions': 'nullable_int', 'num_deletions': 'nullable_int',
+               'num_changed_files': 'nullable_int'}
+
+    large_text_columns = ('body',)
+
+    def __init__(self, records=(), owner_name=None, repo_name=None, client=None, text_mode='keep', text_max_chars=280,
+                 sidecar_path=None):
+        # Urls are the same for every pull request of a repository apart from the number, so they aren't stored
+        self.owner_name = owner_name
+        self.repo_name = repo_name
+        super().__init__(records, client=client, text_mode=text_mode, text_max_chars=text_max_chars,
+                         sidecar_path=sidecar_path)
+
+
+class UserTable(ColumnarTable):
+    columns = {'name': 'text', 'followers': 'nullable_int', 'following': 'nullable_int', 'public_repos': 'nullable_int',
+               'public_gists': 'nullable_int', 'contributions': 'int'}
+
+
+class PullRequestRow(PullRequest):
+    # A pull request that reads and writes its fields in a PullRequestTable instead of keeping its own copy
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+
+    @property
+    def _client(self):
+        return self._table.client
+
+    @property
+    def url(self):
+        return f"{self._client.api_url}/repos/{self._table.owner_name}/{self._table.repo_name}/pulls/{self.number}"
+
+    @property
+    def commits_url(self):
+        return self.url + '/commits'
+
+    @property
+    def diff_url(self):
+        return f"https://github.com/{self._table.owner_name}/{self._table.repo_name}/pull/{self.number}.diff"
+
+
+class UserRow(User):
+    # A user that reads and writes its fields in a UserTable instead of keeping its own copy
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+
+    @property
+    def _client(self):
+        return self._table.client
+
+
+def add_column_properties(row_class, columns):
+    # Every column of the table becomes an attribute of its row view
+    for name in columns:
+        def getter(self, name=name):
+            return self._table.get_value(name, self._index)
+
+        def setter(self, value, name=name):
+            self._table.set_value(name, self._index, value)
+
+        setattr(row_class, name, property(getter, setter))
+
+
+add_column_properties(PullRequestRow, PullRequestTable.columns)
+add_column_properties(UserRow, UserTable.columns)
+PullRequestTable.row_class = PullRequestRow
+UserTable.row_class = UserRow
+
+
+class ContributorCache:
+    def __init__(self, ttl_seconds=None, max_size=None, cache_path=None):
+        import collections
+        # Contributor profiles shared by repositories, keyed by login, with the time each one was downloaded. A login
+        # one repository is downloading is marked as pending, so the others wait for that download instead of
+        # repeating it
+        self.ttl_seconds = ttl_seconds  # Profiles older than this are downloaded again, None keeps them forever
+        self.max_size = max_size  # The least recently used profiles are dropped beyond this many, None keeps all
+        self.cache_path = cache_path  # Optional JSON file the profiles are kept in between sessions
+        self.profiles = collections.OrderedDict()
+        self.hits = 0
+        self.downloads = 0
+        self._pending = dict()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # Repositories finishing at the same time save one after the other
+
+        if self.cache_path is not None and os.path.exists(self.cache_path):
+            self.load()
+
+    def is_fresh(self, entry):
+        import time
+        return self.ttl_seconds is None or time.time() - entry['downloaded_at'] < self.ttl_seconds
+
+    def get(self, login, wait=True):
+        # Returns the saved profile or None, waiting first if another repository is downloading it
+        if wait:
+            with self._lock:
+                event = self._pending.get(login)
+            if event is not None:
+                event.wait()
+
+        with self._lock:
+            entry = self.profiles.get(login)
+            if entry is None or not self.is_fresh(entry):
+                return None
+            self.profiles.move_to_end(login)
+            self.hits += 1
+            return entry['record']
+
+    def claim(self, login):
+        # True when the caller should download this profile, it then has to update or release it
+        with self._lock:
+            entry = self.profiles.get(login)
+            if (entry is not None and self.is_fresh(entry)) or login in self._pending:
+                return False
+            self._pending[login] = threading.Event()
+            return True
+
+    def update(self, records):
+        import time
+        now = time.time()
+        with self._lock:
+            for login, record in records.items():
+                self.profiles[login] = {'downloaded_at': now, 'record': record}
+                self.profiles.move_to_end(login)
+                self.downloads += 1
+            self.trim()
+        self.release(records)
+
+    def restore(self, records):
+        # Profiles saved with a sync or a checkpoint, keyed by login, each with the time it was downloaded so the TTL
+        # still applies to them. Ones saved without that time count as expired, newer cached profiles are kept
+        with self._lock:
+            for login, record in records.items():
+                entry = {'downloaded_at': record.get('downloaded_at', 0), 'record': record}
+                if not self.is_fresh(entry):
+                    continue
+                if login not in self.profiles or self.profiles[login]['downloaded_at'] < entry['downloaded_at']:
+                    self.profiles[login] = entry
+            self.trim()
+
+    def export(self, logins):
+        # The cached profiles of these logins with the time each was downloaded, the way restore takes them
+        with self._lock:
+            return {login: dict(self.profiles[login]['record'], downloaded_at=self.profiles[login]['downloaded_at'])
+                    for login in logins if login in self.profiles}
+
+    def trim(self):
+        # Drop the least recently used profiles beyond max_size, the caller holds the lock
+        if self.max_size is not None:
+            while len(self.profiles) > self.max_size:
+                self.profiles.popitem(last=False)
+
+    def release(self, logins):
+        # Wake up everything waiting for these logins, whether or not their profiles were downloaded
+        with self._lock:
+            for login in logins:
+                event = self._pending.pop(login, None)
+                if event is not None:
+                    event.set()
+
+    def prefetch(self, logins, client=None, max_workers=8):
+        import concurrent.futures
+        # Download every profile that isn't cached yet in as few requests as possible, before it is needed
+        if client is None:
+            client = get_default_client()
+        claimed = [login for login in dict.fromkeys(logins) if self.claim(login)]
+        batch_size = USERS_BATCH_SIZE if client.has_token else 1
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+                futures = [executor.submit(download_user_profiles, claimed[i:i + batch_size], client)
+                           for i in range(0, len(claimed), batch_size)]
+                for future in concurrent.futures.as_completed(futures):
+                    if future.exception() is None:
+                        self.update(future.result())
+        finally:
+            self.release(claimed)
+        self.save()
+
+        return len(claimed)
+
+    def load(self):
+        import json
+        try:
+            with open(self.cache_path) as f:
+                profiles = json.load(f)
+            # The file is written oldest first, so the least recently used order survives
+            fresh = [(login, entry) for login, entry in profiles.items() if self.is_fresh(entry)]
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            # A damaged cache just means downloading the profiles again
+            return
+        with self._lock:
+            for login, entry in fresh:
+                self.profiles[login] = entry
+            self.trim()
+
+    def save(self):
+        import json
+        if self.cache_path is None:
+            return
+
+        # Write to a temporary file first, so a crash never leaves half a cache behind
+        with self._save_lock:
+            with self._lock:
+                profiles = dict(self.profiles)
+            temp_path = self.cache_path + '.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump(profiles, f)
+            os.replace(temp_path, self.cache_path)
+
+
+class SessionStore:
+    pull_request_columns = ('number', 'title', 'body', 'state', 'created_at', 'updated_at', 'closed_at', 'merged_at',
+                            'user', 'num_commits', 'num_additions', 'num_deletions', 'num_changed_files', 'url',
+                            'diff_url')
+    user_columns = ('name', 'followers', 'following', 'public_repos', 'public_gists')
+
+    def __init__(self, db_path='session.db'):
+        import sqlite3
+        self.db_path = db_path
+
+        # One connection is shared by every thread, the lock keeps their transactions apart
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self.create_tables()
+
+    def create_tables(self):
+        with self._lock, self._connection:
+            self._connection.executescript('''
+                CREATE TABLE IF NOT EXISTS repositories (
+                    owner_name TEXT NOT NULL,
+                    repo_name TEXT NOT NULL,
+                    time_window_days INTEGER,
+                    PRIMARY KEY (owner_name, repo_name)
+                );
+                CREATE TABLE IF NOT EXISTS pull_requests (
+                    owner_name TEXT NOT NULL,
+                    repo_name TEXT NOT NULL,
+                    number INTEGER NOT NULL,
+                    title TEXT,
+                    body TEXT,
+                    state TEXT,
+                    created_at TEXT,
+                    updated_at TEXT,
+                    closed_at TEXT,
+                    merged_at TEXT,
+                    user TEXT,
+                    num_commits INTEGER,
+                    num_additions INTEGER,
+                    num_deletions INTEGER,
+                    num_changed_files INTEGER,
+                    url TEXT,
+                    diff_url TEXT,
+                    PRIMARY KEY (owner_name, repo_name, number)
+                );
+                CREATE INDEX IF NOT EXISTS pull_requests_created_at ON pull_requests (created_at);
+                CREATE INDEX IF NOT EXISTS pull_requests_state ON pull_requests (state);
+                CREATE INDEX IF NOT EXISTS pull_requests_user ON pull_requests (user);
+                CREATE TABLE IF NOT EXISTS users (
+                    name TEXT PRIMARY KEY,
+                    followers INTEGER,
+                    following INTEGER,
+                    public_repos INTEGER,
+                    public_gists INTEGER
+                );
+                CREATE TABLE IF NOT EXISTS contributions (
+                    owner_name TEXT NOT NULL,
+                    repo_name TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    contributions INTEGER,
+                    PRIMARY KEY (owner_name, repo_name, name)
+                );
+            ''')
+
+            # Add columns that were introduced after a database was created
+            existing = [row['name'] for row in self._connection.execute('PRAGMA table_info(pull_requests)')]
+            if 'merged_at' not in existing:
+                self._connection.execute('ALTER TABLE pull_requests ADD COLUMN merged_at TEXT')
+
+    def upsert_pull_requests(self, owner_name, repo_name, pull_requests):
+        with self._lock, self._connection:
+            self._upsert_pull_requests(owner_name, repo_name, pull_requests)
+
+    def _upsert_pull_requests(self, owner_name, repo_name, pull_requests):
+        columns = ('owner_name', 'repo_name') + self.pull_request_columns
+        updates = ', '.join(f'{column} = excluded.{column}' for column in self.pull_request_columns[1:])
+        rows = list()
+        for pull in pull_requests:
+            record = pull.to_sync_dict()
+            rows.append((owner_name, repo_name) + tuple(record[column] for column in self.pull_request_columns))
+
+        self._connection.executemany(
+            f'INSERT INTO pull_requests ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))}) '
+            f'ON CONFLICT (owner_name, repo_name, number) DO UPDATE SET {updates}', rows)
+
+    def upsert_users(self, users):
+        with self._lock, self._connection:
+            self._upsert_users(users)
+
+    def _upsert_users(self, users):
+        updates = ', '.join(f'{column} = excluded.{column}' for column in self.user_columns[1:])
+        rows = list()
+        for user in users:
+            record = user.to_dict()
+            rows.append(tuple(record[column] for column in self.user_columns))
+
+        self._connection.executemany(
+            f'INSERT INTO users ({", ".join(self.user_columns)}) VALUES ({", ".join("?" * len(self.user_columns))}) '
+            f'ON CONFLICT (name) DO UPDATE SET {updates}', rows)
+
+    def save_repository(self, repo):
+        # Save everything about a repository in one transaction, so a failed save leaves the last one in place
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT INTO repositories (owner_name, repo_name, time_window_days) VALUES (?, ?, ?) '
+                'ON CONFLICT (owner_name, repo_name) DO UPDATE SET time_window_days = excluded.time_window_days',
+                (repo.owner_name, repo.repo_name, repo.time_window_days))
+
+            # Pull requests that dropped out of the time window are removed
+            numbers = set(pull.number for pull in repo.pull_requests)
+            stored = self._connection.execute('SELECT number FROM pull_requests WHERE owner_name = ? AND repo_name = ?',
+                                              (repo.owner_name, repo.repo_name)).fetchall()
+            self._connection.executemany(
+                'DELETE FROM pull_requests WHERE owner_name = ? AND repo_name = ? AND number = ?',
+                [(repo.owner_name, repo.repo_name, row['number']) for row in stored if row['number'] not in numbers])
+            self._upsert_pull_requests(repo.owner_name, repo.repo_name, repo.pull_requests)
+
+            self._upsert_users(repo.users)
+            self._connection.execute('DELETE FROM contributions WHERE owner_name = ? AND repo_name = ?',
+                                     (repo.owner_name, repo.repo_name))
+            self._connection.executemany(
+                'INSERT INTO contributions (owner_name, repo_name, name, contributions) VALUES (?, ?, ?, ?)',
+                [(repo.owner_name, repo.repo_name, user.name, user.contributions) for user in repo.users])
+
+    def list_repositories(self):
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT owner_name, repo_name, time_window_days FROM repositories ORDER BY owner_name, repo_name'
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def load_pull_requests(self, owner_name, repo_name, created_since=None):
+        query = (f'SELECT {", ".join(self.pull_request_columns)} FROM pull_requests '
+                 'WHERE owner_name = ? AND repo_name = ?')
+        params = [owner_name, repo_name]
+        if created_since is not None:
+            query += ' AND created_at >= ?'
+            params.append(created_since)
+
+        with self._lock:
+            rows = self._connection.execute(query + ' ORDER BY created_at DESC', params).fetchall()
+        return [dict(row) for row in rows]
+
+    def load_users(self, owner_name, repo_name):
+        with self._lock:
+            rows = self._connection.execute(
+                f'SELECT {", ".join("users." + column for column in self.user_columns)}, contributions.contributions '
+                'FROM contributions JOIN users ON users.name = contributions.name '
+                'WHERE contributions.owner_name = ? AND contributions.repo_name = ?',
+                (owner_name, repo_name)).fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class ResponseCache:
+    # Response headers that are needed to revalidate and to rebuild a response from the cache
+    stored_headers = ('ETag', 'Last-Modified', 'Link', 'Content-Type')
+
+    def __init__(self, cache_dir='http_cache/', max_size_bytes=100 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.hits = 0  # Responses served from the cache after a 304
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        # Remember the size of every entry so eviction doesn't have to scan the directory each time
+        self._sizes = dict()
+        for file_name in os.listdir(self.cache_dir):
+            self._sizes[file_name] = os.path.getsize(os.path.join(self.cache_dir, file_name))
+        self._total_size = sum(self._sizes.values())
+
+    def count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def make_key(self, url, params=None):
+        import hashlib
+        import json
+        key = json.dumps([url, sorted((params or dict()).items())])
+        return hashlib.sha256(key.encode('utf-8')).hexdigest() + '.json.z'
+
+    def load(self, url, params=None):
+        import json
+        import zlib
+        file_name = self.make_key(url, params)
+        path = os.path.join(self.cache_dir, file_name)
+        with self._lock:
+            if file_name not in self._sizes:
+                return None
+            try:
+                with open(path, 'rb') as f:
+                    entry = json.loads(zlib.decompress(f.read()).decode('utf-8'))
+                # Touch the file so the modification time tracks the last use for LRU eviction
+                os.utime(path)
+            except (OSError, ValueError, zlib.error):
+                # A damaged entry is treated like a missing one
+                self._remove(file_name)
+                return None
+
+        return entry
+
+    def store(self, url, params, response):
+        import json
+        import zlib
+        headers = {name: response.headers[name] for name in self.stored_headers if name in response.headers}
+        entry = {'url': url, 'params': params, 'headers': headers, 'body': response.text}
+        data = zlib.compress(json.dumps(entry).encode('utf-8'))
+        if len(data) > self.max_size_bytes:
+            return
+
+        file_name = self.make_key(url, params)
+        with self._lock:
+            with open(os.path.join(self.cache_dir, file_name), 'wb') as f:
+                f.write(data)
+            self._total_size += len(data) - self._sizes.get(file_name, 0)
+            self._sizes[file_name] = len(data)
+            if self._total_size > self.max_size_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Remove the least recently used entries until the cache fits in its size limit again
+        def last_used(file_name):
+            try:
+                return os.path.getmtime(os.path.join(self.cache_dir, file_name))
+            except OSError:
+                return 0
+
+        for file_name in sorted(self._sizes, key=last_used):
+            if self._total_size <= self.max_size_bytes:
+                break
+            self._remove(file_name)
+
+    def _remove(self, file_name):
+        try:
+            os.remove(os.path.join(self.cache_dir, file_name))
+        except OSError:
+            pass
+        self._total_size -= self._sizes.pop(file_name, 0)
+
+    def to_response(self, entry, url):
+        import requests
+        from requests.structures import CaseInsensitiveDict
+
+        # Rebuild a normal response so callers can't tell it came from the cache
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.encoding = 'utf-8'
+        response._content = entry['body'].encode('utf-8')
+        return response
+
+
+class RateLimiter:
+    def __init__(self, reserve=0, pace_below=0.1, max_retries=5, backoff_base=1.0, backoff_max=60.0, max_wait=None,
+                 verbose=False, stop_event=None):
+        self.reserve = reserve  # Number of requests per resource that are never used
+        self.pace_below = pace_below  # Fraction of the budget below which requests are spread out until the reset
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_wait = max_wait  # Longest wait in seconds before giving up, None waits as long as Github asks
+        self.verbose = verbose
+        # Setting this threading.Event ends every wait early with an InterruptedError, so stopping downloads doesn't
+        # have to wait for a rate limit to reset
+        self.stop_event = stop_event
+
+        # Latest known budget for each token and rate limit resource (core, search, graphql), keyed by
+        # (token slot, resource). Anonymous requests use the slot None
+        self.budgets = dict()
+        # Requests sent but not answered yet, keyed the same way. They are held back from the budget until their
+        # response reports the real count
+        self.in_flight = dict()
+        self.requests_made = 0
+        self.retries = 0
+        self.seconds_waited = 0.0
+        self.coalesced = 0  # Requests that were not sent because the same one was already in flight
+        self._next_slot = dict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def resource_for(url):
+        if url.rstrip('/').endswith('/graphql'):
+            return 'graphql'
+        elif '/search/' in url:
+            return 'search'
+        return 'core'
+
+    def wait_for_budget(self, resource, slots=(None,)):
+        import time
+        wait = 0
+        with self._lock:
+            now = time.time()
+
+            # Use the token with the most budget left. A token without a known budget hasn't been used yet
+            def usable(slot):
+                info = self.budgets.get((slot, resource))
+                if info is None or info['reset'] <= now:
+                    return float('inf')
+                return info['remaining'] - self.in_flight.get((slot, resource), 0) - self.reserve
+
+            chosen = max(slots, key=usable)
+            info = self.budgets.get((chosen, resource))
+            if usable(chosen) <= 0:
+                # Every token is used up, wait for the first one Github resets
+                chosen = min(slots, key=lambda slot: self.budgets[(slot, resource)]['reset'])
+                info = self.budgets[(chosen, resource)]
+                wait = info['reset'] - now + 1
+            elif usable(chosen) < float('inf') and usable(chosen) < info['limit'] * self.pace_below:
+                # The budget is running low, spread the remaining requests evenly until the reset
+                interval = (info['reset'] - now) / usable(chosen)
+                next_slot = max(now, self._next_slot.get((chosen, resource), 0))
+                self._next_slot[(chosen, resource)] = next_slot + interval
+                wait = next_slot - now
+
+            # Hold this request back from the budget right away so concurrent threads don't all use the last of it
+            self.in_flight[(chosen, resource)] = self.in_flight.get((chosen, resource), 0) + 1
+            self.requests_made += 1
 
-        # Write a single row that could be the headers
-        csv_writer.writerow(
-            [self.name, self.followers, self.following, self.public_repos, self.public_gists, self.contributions])
+        try:
+            self.sleep(wait, f'Github {resource} rate limit is almost used up')
+        except BaseException:
+            # Waiting too long gives up on the request, so it is never sent
+            self.finish(resource, chosen)
+            raise
+        return chosen
+
+    def record(self, response, resource, slot=None):
+        # Every response carries the current budget in its headers
+        headers = response.headers
+        if 'X-RateLimit-Remaining' not in headers:
+            return
+
+        resource = headers.get('X-RateLimit-Resource', resource)
+        try:
+            limit = int(headers.get('X-RateLimit-Limit', 0))
+            remaining = int(headers['X-RateLimit-Remaining'])
+            reset = int(headers.get('X-RateLimit-Reset', 0))
+        except ValueError:
+            return
+
+        # Github's count is trusted, free requests like 304 revalidations don't lower it. Within one window the count
+        # only goes down, so a higher one comes from a response that arrived late and the lowest is kept. A late
+        # response from an earlier window is ignored
+        with self._lock:
+            info = self.budgets.get((slot, resource))
+            if info is not None and reset < info['reset']:
+                return
+            if info is not None and reset == info['reset']:
+                remaining = min(remaining, info['remaining'])
+            self.budgets[(slot, resource)] = {'limit': limit, 'remaining': remaining, 'reset': reset}
+
+    def finish(self, resource, slot=None):
+        # The request was answered or failed, it no longer needs to be held back from the budget
+        with self._lock:
+            self.in_flight[(slot, resource)] -= 1
+
+    def backoff(self, attempt):
+        import random
+        # Exponential backoff with full jitter so retrying threads don't hit the server at the same moment
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def retry_delay(self, response, attempt):
+        if attempt >= self.max_retries:
+            return None
+
+        if response.status_code in (403, 429):
+            text = response.text.lower()
+            if ('Retry-After' in response.headers or response.headers.get('X-RateLimit-Remaining') == '0'
+                    or 'secondary rate limit' in text or 'abuse' in text):
+                return self.rate_limit_delay(response, attempt)
+            # Any other 403 is a real permission problem
+            return None
+
+        if response.status_code >= 500:
+            return self.backoff(attempt)
 
-        # Get the CSV-formatted string from the virtual file
-        csv_string = csv_output.getvalue().encode('ascii', 'ignore').decode('ascii')
+        return None
 
-        csv_output.close()
+    def rate_limit_delay(self, response, attempt):
+        if 'Retry-After' in response.headers:
+            try:
+                return float(response.headers['Retry-After'])
+            except ValueError:
+                pass
+        if response.headers.get('X-RateLimit-Remaining') == '0':
+            # Primary rate limit. The budget was recorded as empty, so the next attempt moves to another token or
+            # waits for the reset in wait_for_budget
+            return 0
+        # Secondary rate limit. Github asks to wait at least a minute when it doesn't say how long
+        return max(60, self.backoff(attempt))
+
+    def count_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def count_coalesced(self):
+        with self._lock:
+            self.coalesced += 1
+
+    def sleep(self, seconds, reason):
+        import time
+        if seconds <= 0:
+            return
+        if self.max_wait is not None and seconds > self.max_wait:
+            raise PermissionError(f'{reason}. Waiting {int(seconds)} seconds is longer than the allowed '
+                                  f'{int(self.max_wait)} seconds.')
+        if self.verbose and seconds >= 1:
+            print(f'{reason}, waiting {int(seconds)} seconds...')
+
+        with self._lock:
+            self.seconds_waited += seconds
+        if self.stop_event is None:
+            time.sleep(seconds)
+        elif self.stop_event.wait(seconds):
+            raise InterruptedError(f'{reason}. Stopped while waiting')
+
+    def state(self):
+        with self._lock:
+            # Add up the budgets of all tokens for each resource
+            limits = dict()
+            for (slot, resource), info in self.budgets.items():
+                total = limits.setdefault(resource, {'limit': 0, 'remaining': 0, 'reset': info['reset']})
+                total['limit'] += info['limit']
+                total['remaining'] += max(0, info['remaining'])
+                total['reset'] = min(total['reset'], info['reset'])
+
+            return {'limits': limits,
+                    'tokens': {slot: {resource: dict(info) for (s, resource), info in self.budgets.items() if s == slot}
+                               for slot in set(slot for slot, resource in self.budgets)},
+                    'requests_made': self.requests_made,
+                    'retries': self.retries,
+                    'seconds_waited': self.seconds_waited,
+                    'coalesced': self.coalesced}
+
+
+class GitHubClient:
+    def __init__(self, token=None, pool_size=10, api_url='https://api.github.com', cache=None, rate_limiter=None,
+                 tokens=None, max_page_workers=1):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        # Pool of tokens, each request uses the one with the most budget left. DO NOT INCLUDE IN OUTPUTS.
+        self.__tokens = list(tokens or list())
+        if token is not None and token not in self.__tokens:
+            self.__tokens.insert(0, token)
+        self.revoked_slots = set()  # Tokens that Github rejected are not used again
+        # Number of list pages downloaded at the same time once the last page number is known
+        self.max_page_workers = max_page_workers
+        self.api_url = api_url.rstrip('/')
+        self.graphql_url = self.api_url + '/graphql'
+        self.cache = cache  # Optional ResponseCache used to revalidate GET requests instead of downloading again
+        # Paces requests to the remaining budget and retries rate limited and failed requests
+        if rate_limiter is None:
+            rate_limiter = RateLimiter()
+        self.rate_limiter = rate_limiter
+
+        # One session is shared by every request so connections are kept alive and reused between calls
+        self.session = requests.Session()
+        self.session.headers.update({'Accept': 'application/vnd.github+json', 'X-GitHub-Api-Version': '2022-11-28'})
+
+        # Keep enough connections open for all the worker threads that share this client
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        # GET requests in flight, keyed by url and parameters, so threads asking for the same one can share it. The
+        # lock guards them and the revoked tokens
+        self._in_flight = dict()
+        self._lock = threading.Lock()
+
+    @property
+    def has_token(self):
+        return len(self.live_slots()) > 0
+
+    @property
+    def n_tokens(self):
+        return len(self.live_slots())
+
+    def live_slots(self):
+        with self._lock:
+            return [slot for slot in range(len(self.__tokens)) if slot not in self.revoked_slots]
+
+    def request(self, method, url, **kwargs):
+        import requests
+        resource = self.rate_limiter.resource_for(url)
+        headers = kwargs.pop('headers', None) or dict()
+        attempt = 0
+        while True:
+            # Requests are anonymous only when no token was configured at all
+            slots = self.live_slots() if len(self.__tokens) > 0 else [None]
+            if len(slots) == 0:
+                raise PermissionError('Server Error 401: Access to Github API denied. Every configured access token '
+                                      'was rejected. Create new tokens at https://github.com/settings/tokens?type=beta')
+            slot = self.rate_limiter.wait_for_budget(resource, slots)
+
+            request_headers = dict(headers)
+            if slot is not None:
+                request_headers['Authorization'] = f'token {self.__tokens[slot]}'
+            try:
+                try:
+                    response = self.session.request(method, url, headers=request_headers, **kwargs)
+                finally:
+                    self.rate_limiter.finish(resource, slot)
+            except (requests.ConnectionError, requests.Timeout):
+                # Network drops are retried like server errors
+                if attempt >= self.rate_limiter.max_retries:
+                    raise
+                delay = self.rate_limiter.backoff(attempt)
+            else:
+                self.rate_limiter.record(response, resource, slot)
+                if response.status_code == 401 and slot is not None and len(slots) > 1:
+                    # This token was revoked or expired, try the request again with the others
+                    with self._lock:
+                        self.revoked_slots.add(slot)
+                    continue
+                delay = self.rate_limiter.retry_delay(response, attempt)
+                if delay is None:
+                    return response
+
+            attempt += 1
+            self.rate_limiter.count_retry()
+            self.rate_limiter.sleep(delay, f'Github request to {url} failed or was rate limited')
+
+    def get_response(self, url, params=None):
+        import concurrent.futures
+        import json
+
+        # Concurrent callers asking for the same url and parameters wait for a single request and share its response
+        key = (url, json.dumps(params, sort_keys=True))
+        with self._lock:
+            future = self._in_flight.get(key)
+            first_caller = future is None
+            if first_caller:
+                future = concurrent.futures.Future()
+                self._in_flight[key] = future
+
+        if not first_caller:
+            self.rate_limiter.count_coalesced()
+            return future.result()
 
-        return csv_string
+        try:
+            response = self.download_response(url, params=params)
+            # Read and parse the whole body before the response is shared, so waiting callers reuse the parsed result
+            # instead of each parsing it again
+            response.content
+            if 'json' in response.headers.get('Content-Type', ''):
+                try:
+                    response.parsed_json = response.json()
+                except ValueError:
+                    pass
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def download_response(self, url, params=None):
+        if self.cache is None:
+            return self.request('GET', url, params=params)
+
+        # Ask Github if the cached copy is still current. A 304 answer does not count against the rate limit
+        entry = self.cache.load(url, params)
+        headers = dict()
+        if entry is not None:
+            if 'ETag' in entry['headers']:
+                headers['If-None-Match'] = entry['headers']['ETag']
+            if 'Last-Modified' in entry['headers']:
+                headers['If-Modified-Since'] = entry['headers']['Last-Modified']
+
+        response = self.request('GET', url, params=params, headers=headers)
+
+        if response.status_code == 304 and entry is not None:
+            self.cache.count(hit=True)
+            return self.cache.to_response(entry, response.url)
+
+        self.cache.count(hit=False)
+        if response.status_code == 200 and ('ETag' in response.headers or 'Last-Modified' in response.headers):
+            self.cache.store(url, params, response)
+
+        return response
+
+    def iter_responses(self, url, params=None):
+        # Yield every page of results by following the next links
+        while url is not None:
+            response = self.get_response(url, params=params)
+            check_response(response)
+            yield response
+
+            # The next page URL already contains the query parameters of the first request
+            url = response.links['next']['url'] if 'next' in response.links else None
+            params = None
+
+    def iter_pages(self, url, params=None, time_window_days=None, updated_since=None, max_page_workers=None):
+        import concurrent.futures
+        import datetime
+        cutoff_date = None
+        if time_window_days is not None:
+            cutoff_date = datetime.datetime.now() - datetime.timedelta(days=time_window_days)
+        if max_page_workers is None:
+            max_page_workers = self.max_page_workers
+
+        # Yield the parsed records of each page as soon as it arrives, so callers can start working on them while
+        # the next pages are still being listed
+        response = self.get_response(url, params=params)
+        check_response(response)
+        page_urls = self.get_page_urls(response) if max_page_workers > 1 else None
+        if page_urls is None:
+            # Follow the next links one page at a time
+            while True:
+                page, another_page = self.filter_page(self.parse_json(response), 'next' in response.links, cutoff_date,
+                                                      updated_since)
+                yield page
+                if not another_page:
+                    break
+                response = self.get_response(response.links['next']['url'])
+                check_response(response)
+            return
+
+        # The first page told us where the last page is, so the remaining pages are downloaded in waves of
+        # max_page_workers at a time. Waves keep the order of the pages and let the time window stop the download
+        # without fetching every page up to the last one
+        page, another_page = self.filter_page(self.parse_json(response), True, cutoff_date, updated_since)
+        yield page
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_page_workers) as executor:
+            for i in range(0, len(page_urls), max_page_workers):
+                if not another_page:
+                    break
+                wave = page_urls[i:i + max_page_workers]
+                for page_number, page_json in enumerate(executor.map(self.get_page_json, wave), start=i):
+                    is_last = page_number == len(page_urls) - 1
+                    page, another_page = self.filter_page(page_json, not is_last, cutoff_date, updated_since)
+                    yield page
+                    if not another_page:
+                        break
+
+    def get_page_json(self, url):
+        response = self.get_response(url)
+        check_response(response)
+        return self.parse_json(response)
+
+    @staticmethod
+    def parse_json(response):
+        # The body of a response from get_response is already parsed, and shared by every caller that asked for it
+        if hasattr(response, 'parsed_json'):
+            return response.parsed_json
+        return response.json()
+
+    @staticmethod
+    def get_page_urls(response):
+        from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
+
+        # Build the urls of pages 2 to last from the last page link, when the endpoint uses page numbers
+        if 'next' not in response.links or 'last' not in response.links:
+            return None
+        next_url = urlparse(response.links['next']['url'])
+        last_url = urlparse(response.links['last']['url'])
+        next_query = parse_qs(next_url.query)
+        last_query = parse_qs(last_url.query)
+        if 'page' not in next_query or 'page' not in last_query:
+            return None
+
+        page_urls = list()
+        for page_number in range(int(next_query['page'][0]), int(last_query['page'][0]) + 1):
+            next_query['page'] = [str(page_number)]
+            page_urls.append(urlunparse(next_url._replace(query=urlencode(next_query, doseq=True))))
+        return page_urls
+
+    @staticmethod
+    def filter_page(page, another_page, cutoff_date=None, updated_since=None):
+        import datetime
+        if another_page and type(page) is not list:
+            raise ValueError("Can't resolve multi-page dictionary response")
+
+        if cutoff_date is not None and type(page) is list and len(page) > 0:
+            # Pages are sorted newest first, so a page that reaches the cutoff is the last one needed
+            last_date_downloaded = datetime.datetime.strptime(page[-1]['created_at'], '%Y-%m-%dT%H:%M:%SZ')
+            if last_date_downloaded <= cutoff_date:
+                another_page = False
+            # Filter by date, including on the last page
+            page = [record for record in page if
+                    datetime.datetime.strptime(record['created_at'], '%Y-%m-%dT%H:%M:%SZ') >= cutoff_date]
+
+        if updated_since is not None and type(page) is list and len(page) > 0:
+            # Results sorted by update time can stop at the first record that hasn't changed since the last sync
+            if page[-1]['updated_at'] <= updated_since:
+                another_page = False
+            page = [record for record in page if record['updated_at'] > updated_since]
+
+        return page, another_page
+
+    def get(self, url, convert_json=True, params=None, time_window_days=None, updated_since=None,
+            max_page_workers=None):
+        if not convert_json:
+            results = str()
+            for response in self.iter_responses(url, params=params):
+                results = results + response.text
+            return results
 
-    def save_to_csv(self):
-        save_as_csv('users.csv', self)
+        results = list()
+        for page in self.iter_pages(url, params=params, time_window_days=time_window_days,
+                                    updated_since=updated_since, max_page_workers=max_page_workers):
+            if type(page) is list:
+                results.extend(page)
+            else:
+                results = page
+
+        return results
+
+    def graphql(self, query, variables=None, allow_partial=False):
+        # The GraphQL API only accepts authenticated requests
+        if not self.has_token:
+            raise PermissionError('The Github GraphQL API requires an authentication token. Create one at '
+                                  'https://github.com/settings/tokens?type=beta')
+
+        attempt = 0
+        while True:
+            response = self.request('POST', self.graphql_url, json={'query': query, 'variables': variables or dict()})
+            check_response(response)
+
+            # GraphQL reports most errors with a 200 status code, including its own rate limit
+            response_json = response.json()
+            errors = response_json.get('errors') or list()
+            if not any(error.get('type') == 'RATE_LIMITED' for error in errors):
+                break
+            if attempt >= self.rate_limiter.max_retries:
+                raise PermissionError('Github GraphQL API rate limit exceeded. Read more: \n\n' + response.text)
+            delay = self.rate_limiter.rate_limit_delay(response, attempt)
+            attempt += 1
+            self.rate_limiter.count_retry()
+            self.rate_limiter.sleep(delay, 'Github GraphQL rate limit exceeded')
+
+        if allow_partial and response_json.get('data') is not None:
+            # Fields that failed are null in the data, let the caller decide what to do with them
+            return response_json['data']
+        if response_json.get('errors'):
+            messages = '\n'.join(error.get('message', '') for error in response_json['errors'])
+            if any(error.get('type') == 'NOT_FOUND' for error in response_json['errors']):
+                raise ValueError('Error 404: No data found for this query \n\n' + messages)
+            raise ConnectionError('Github GraphQL API returned errors: \n\n' + messages)
+
+        return response_json['data']
+
+    def close(self):
+        self.session.close()
+
+
+PULL_REQUESTS_QUERY = '''
+query($owner: String!, $name: String!, $first: Int!, $after: String, $states: [PullRequestState!], $labels: [String!],
+      $baseRefName: String) {
+  repository(owner: $owner, name: $name) {
+    pullRequests(first: $first, after: $after, orderBy: {field: CREATED_AT, direction: DESC}, states: $states,
+                 labels: $labels, baseRefName: $baseRefName) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        number title body state createdAt updatedAt closedAt mergedAt isDraft baseRefName
+        labels(first: 20) { nodes { name } }
+        author { login __typename }
+        additions deletions changedFiles
+        commits { totalCount }
+      }
+    }
+  }
+}
+'''
+
+# Public counts only, so they match the REST /users/{login} fields
+USER_FIELDS = ('followers { totalCount } following { totalCount } '
+               'repositories(privacy: PUBLIC, ownerAffiliations: OWNER) { totalCount } '
+               'gists(privacy: PUBLIC) { totalCount }')
+USERS_BATCH_SIZE = 100
+
+# The search API stops after this many results for one query. Github was founded in 2008, so no pull request is
+# older than SEARCH_START_DATE
+SEARCH_RESULTS_LIMIT = 1000
+SEARCH_START_DATE = '2008-01-01T00:00:00Z'
+# Pull request columns that need a request per pull request with the REST API
+DIFF_METRIC_COLUMNS = ('num_commits', 'num_additions', 'num_deletions', 'num_changed_files')
+# Seconds a profile in the process wide contributor cache is reused for
+DEFAULT_USER_CACHE_TTL = 24 * 60 * 60
+
+_default_clients = dict()
+_default_clients_lock = threading.Lock()
+_default_user_cache = None
+
+
+def get_default_client(token=None):
+    # Share one client per token for callers that don't pass their own client
+    with _default_clients_lock:
+        if token not in _default_clients:
+            _default_clients[token] = GitHubClient(token=token)
+        return _default_clients[token]
+
+
+def get_default_user_cache():
+    # Profiles downloaded by repositories that don't pass their own cache are shared by the whole process
+    global _default_user_cache
+    with _default_clients_lock:
+        if _default_user_cache is None:
+            _default_user_cache = ContributorCache(ttl_seconds=DEFAULT_USER_CACHE_TTL)
+        return _default_user_cache
+
+
+def fill_users_graphql(user_list, client):
+    import json
+
+    # Ask for every user in one query by giving each lookup its own alias
+    fields = list()
+    for i, user in enumerate(user_list):
+        fields.append(f'u{i}: user(login: {json.dumps(user.name)}) {{ {USER_FIELDS} }}')
+    data = client.graphql('query {\n' + '\n'.join(fields) + '\n}', allow_partial=True)
+
+    # Users GraphQL could not resolve are returned so they can be downloaded another way
+    missing = list()
+    for i, user in enumerate(user_list):
+        node = data.get(f'u{i}')
+        if node is None:
+            missing.append(user)
+        else:
+            user.fill_from_graphql(node)
 
+    return missing
 
-def get_github_api_request(url, convert_json=True, params=None, time_window_days=None, token=None):
-    import requests
-    if time_window_days is not None:
-        import datetime
-        cutoff_date = datetime.datetime.now() - datetime.timedelta(days=time_window_days)
 
-    if convert_json:
-        results = list()
-    else:
-        results = str()
-    another_page = True
+def download_user_profiles(logins, client):
+    # Download the profiles of a batch of contributors, GraphQL first when there is a token
+    user_list = [User(name=login, client=client) for login in logins]
+    missing = fill_users_graphql(user_list, client) if client.has_token else user_list
+    for user in missing:
+        user.fill_from_json(client.get(f'{client.api_url}/users/{user.name}'))
 
-    while another_page:
-        if token is None:
-            # Make a GET request to retrieve pull requests
-            response = requests.get(url)
-        else:
-            # Headers including the Authorization token
-            headers = {"Authorization": f"token {token}"}
+    return {user.name: user.to_dict() for user in user_list}
 
-            # Make a GET request to retrieve pull requests
-            response = requests.get(url, headers=headers, params=params)
 
-        # Check if the request was successful (status code 200)
-        if response.status_code == 200:
-            if convert_json:
-                if type(response.json()) is list:
-                    results.extend(response.json())
-                else:
-                    results = response.json()
+def combine_users(repos):
+    # One user per contributor of the repositories, with their contributions to all of them added up
+    users = dict()
+    for repo in repos:
+        for user in repo.users:
+            if user.name in users:
+                users[user.name].contributions += user.contributions
             else:
-                results = results + response.text
+                combined_user = User(name=user.name, client=repo.client)
+                combined_user.fill_from_dict(user.to_dict())
+                combined_user.contributions = user.contributions
+                users[user.name] = combined_user
 
-        elif response.status_code == 401:
-            raise PermissionError(
-                'Server Error 401: Access to Github API denied. You may be using an expired access token.'
-                'Create new token at https://github.com/settings/tokens?type=beta. Read more: \n\n' + response.text)
-        elif response.status_code == 403:
-            raise PermissionError('Server Error 403: Access to Github API denied. Consider creating and using an'
-                                  ' authentication token https://github.com/settings/tokens?type=beta. Read more: \n\n' + response.text)
-        elif response.status_code == 404:
-            raise ValueError('Error 404: No data found at this URL')
+    return list(users.values())
 
-        else:
-            raise ConnectionError(
-                f"Failed to access Github API. Status code: {response.status_code} \n\n" + response.text)
-
-        if 'next' in response.links:  # check if there is another page of results
-            if time_window_days is not None:
-                last_date_downloaded = datetime.datetime.strptime(results[-1]['created_at'], '%Y-%m-%dT%H:%M:%SZ')
-                if last_date_downloaded <= cutoff_date:
-                    another_page = False
-                    # Filter by date
-                    results = [record for record in results if
-                               datetime.datetime.strptime(record['created_at'], '%Y-%m-%dT%H:%M:%SZ') >= cutoff_date]
-
-            url = response.links['next']['url']
-            if type(results) is not list:
-                raise ValueError("Can't resolve multi-page dictionary response")
-        else:
-            another_page = False
 
-    return results
+def check_response(response):
+    # Check if the request was successful (status code 200)
+    if response.status_code == 200:
+        return
+
+    elif response.status_code == 401:
+        raise PermissionError(
+            'Server Error 401: Access to Github API denied. You may be using an expired access token.'
+            'Create new token at https://github.com/settings/tokens?type=beta. Read more: \n\n' + response.text)
+    elif response.status_code == 403:
+        raise PermissionError('Server Error 403: Access to Github API denied. Consider creating and using an'
+                              ' authentication token https://github.com/settings/tokens?type=beta. Read more: \n\n' + response.text)
+    elif response.status_code == 404:
+        raise ValueError('Error 404: No data found at this URL')
+
+    else:
+        raise ConnectionError(
+            f"Failed to access Github API. Status code: {response.status_code} \n\n" + response.text)
+
+
+def get_github_api_request(url, convert_json=True, params=None, time_window_days=None, token=None, client=None):
+    if client is None:
+        client = get_default_client(token)
+
+    return client.get(url, convert_json=convert_json, params=params, time_window_days=time_window_days)
+
+
+def load_repositories(store, time_window_days=None, verbose=False):
+    # Build a Repository for every repository saved in the store, without going to the network
+    repos = list()
+    for record in store.list_repositories():
+        repos.append(Repository(record['owner_name'], record['repo_name'], time_window_days=time_window_days,
+                                verbose=verbose, engine='store', store=store))
+    return repos
+
+
+def load_manifest(file_name, default_time_window_days=365):
+    # One repository per line written as owner/repo, optionally followed by a time window in days. Blank lines and
+    # anything after a # are skipped
+    entries = list()
+    with open(file_name) as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.split('#', 1)[0].strip()
+            if line == '':
+                continue
+
+            parts = line.replace(',', ' ').split()
+            owner_name, _, repo_name = parts[0].partition('/')
+            if owner_name == '' or repo_name == '' or '/' in repo_name or len(parts) > 2:
+                raise ValueError(f"{file_name} line {line_number}: expected 'owner/repo [days]', got '{line}'")
+            try:
+                time_window_days = int(parts[1]) if len(parts) == 2 else default_time_window_days
+            except ValueError:
+                raise ValueError(f"{file_name} line {line_number}: '{parts[1]}' is not a number of days") from None
+            entries.append((owner_name, repo_name, time_window_days))
+
+    return entries
+
+
+def download_repositories(entries, max_repos=4, **repository_kwargs):
+    import concurrent.futures
+    # Download several (owner_name, repo_name, time_window_days) entries at the same time. Passing one client in
+    # repository_kwargs makes all of them share its rate limiter, so together they stay within the token budget.
+    # Yields (owner_name, repo_name, repository) as each one finishes, with the exception in place of the repository
+    # when it failed
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_repos) as executor:
+        futures = {executor.submit(Repository, owner_name, repo_name, time_window_days=time_window_days,
+                                   **repository_kwargs): (owner_name, repo_name)
+                   for owner_name, repo_name, time_window_days in entries}
+        for future in concurrent.futures.as_completed(futures):
+            owner_name, repo_name = futures[future]
+            try:
+                yield owner_name, repo_name, future.result()
+            except Exception as e:
+                yield owner_name, repo_name, e
+
+
+def list_owner_repositories(owner_name, client=None, include_forks=False, include_archived=False, name_pattern=None):
+    import fnmatch
+    # Names of the repositories a user or organization owns. Forks and archived repositories are left out unless asked
+    # for, and name_pattern can narrow the list down with wildcards like 'api-*'
+    if client is None:
+        client = get_default_client()
+    owner = client.get(f'{client.api_url}/users/{owner_name}')
+    repos = client.get(owner['repos_url'], params={'per_page': '100'})
+
+    repo_names = list()
+    for repo in repos:
+        if repo['owner']['login'] != owner['login']:
+            continue
+        if (repo.get('fork') and not include_forks) or (repo.get('archived') and not include_archived):
+            continue
+        if name_pattern is not None and not fnmatch.fnmatch(repo['name'], name_pattern):
+            continue
+        repo_names.append(repo['name'])
+
+    return owner['login'], repo_names
+
+
+def allocate_sample(sample_size, stratum_sizes, minimum=0):
+    # Split a sample between strata in proportion to their sizes, after giving every stratum minimum draws (or all of
+    # its members when it has fewer). Rounding leftovers go to the strata with the largest remainders, so the sample
+    # adds up exactly and never asks for more than a stratum has
+    total = sum(stratum_sizes.values())
+    if sample_size >= total:
+        return dict(stratum_sizes)
+
+    minimum = min(minimum, sample_size // max(1, len(stratum_sizes)))
+    allocation = {key: min(size, minimum) for key, size in stratum_sizes.items()}
+    rest = sample_size - sum(allocation.values())
+    if rest <= 0:
+        return allocation
+
+    capacity = {key: size - allocation[key] for key, size in stratum_sizes.items()}
+    exact = {key: rest * size / sum(capacity.values()) for key, size in capacity.items()}
+    extra = {key: int(value) for key, value in exact.items()}
+    leftover = rest - sum(extra.values())
+    for key in sorted(exact, key=lambda key: exact[key] - extra[key], reverse=True)[:leftover]:
+        extra[key] += 1
+
+    return {key: allocation[key] + extra[key] for key in allocation}
+
+
+def print_progress(progress, tics):
+    # Print a progress bar for every tic that has been reached since the last call
+    while len(tics) > 0 and progress >= tics[0]:
+        tic = tics.pop(0)
+        print('[' + '#' * (tic // 5) + '-' * ((100 - tic) // 5) + '] ' + str(tic) + '%')
+
+
+def to_csv_string(row):
+    import csv
+    import io
+    csv_output = io.StringIO()
+    # Create a CSV writer
+    csv_writer = csv.writer(csv_output, dialect='excel')
+
+    # Write a single row
+    csv_writer.writerow(row)
+
+    # Get the CSV-formatted string from the virtual file
+    csv_string = csv_output.getvalue().encode('ascii', 'ignore').decode('ascii')
+
+    csv_output.close()
+
+    return csv_string
 
 
 def save_as_csv(file_name, gitdata_object):
-    # Check if the file exists
-    file_exists = os.path.exists(file_name)
-    header = gitdata_object.to_csv_header()
-    data = gitdata_object.to_csv_record()
+    save_many_as_csv(file_name, [gitdata_object])
+
+
+def save_many_as_csv(file_name, gitdata_objects):
+    import csv
+    # Write all the objects in one pass through a single writer. The header only goes in when the file is new, and
+    # characters that aren't ascii are dropped like in to_csv_record
+    gitdata_objects = iter(gitdata_objects)
+    first_object = next(gitdata_objects, None)
+    if first_object is None:
+        return
 
-    # Open the file in append mode
-    with open(file_name, 'a', newline='') as file:
-        # If it's a new file, write the header
+    file_exists = os.path.exists(file_name)
+    with open(file_name, 'a', newline='', encoding='ascii', errors='ignore') as file:
+        csv_writer = csv.writer(file, dialect='excel')
         if not file_exists:
-            file.write(header)
-        else:
-            # Write the CSV record
-            file.write(data)
+            csv_writer.writerow(first_object.csv_columns)
+        csv_writer.writerow(first_object.to_csv_row())
+        csv_writer.writerows(gitdata_object.to_csv_row() for gitdata_object in gitdata_objects)
+
+
+def save_as_parquet(file_name, table, compression='zstd'):
+    # pyarrow is only needed for Parquet files, so it is imported here
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError('Saving as Parquet needs pyarrow, install it with: pip install pyarrow') from None
+
+    pq.write_table(table.to_arrow(), file_name, compression=compression)
@@ -1,4 +1,55 @@
+import argparse
+import sys
+
 import application
+import gitdata
+
+parser = argparse.ArgumentParser(description='Download and analyze pull requests of Github repositories')
+parser.add_argument('--manifest', help='run without menus, downloading every owner/repo [days] line of this file')
+parser.add_argument('--owner', help='run without menus, downloading every repository of this user or organization')
+parser.add_argument('--match',
+                    help="with --owner, only download repositories whose name matches a pattern like 'api-*'")
+parser.add_argument('--include-forks', action='store_true', help='with --owner, download forks too')
+parser.add_argument('--include-archived', action='store_true',
+                    help='with --owner, download archived repositories too')
+parser.add_argument('--author', action='append', help='only keep pull requests by this author, can be repeated')
+parser.add_argument('--exclude-author', action='append', help='leave out pull requests by this author')
+parser.add_argument('--exclude-bots', action='store_true', help='leave out pull requests opened by bots')
+parser.add_argument('--exclude-drafts', action='store_true', help='leave out draft pull requests')
+parser.add_argument('--label', action='append', help='only keep pull requests with any of these labels')
+parser.add_argument('--exclude-label', action='append', help='leave out pull requests with this label')
+parser.add_argument('--base', action='append', help='only keep pull requests into this base branch')
+parser.add_argument('--state', choices=['open', 'closed'], help='only keep open or closed pull requests')
+parser.add_argument('--sample-size', type=int,
+                    help='only download diff metrics for a random sample of this many pull requests per repository, '
+                         'analyses then report estimates with confidence intervals')
+parser.add_argument('--data-dir', default='Temp_session_data/', help='folder where the session data is written')
+parser.add_argument('--max-repos', type=int, default=4, help='repositories downloaded at the same time')
+parser.add_argument('--days', type=int, default=365, help='time window for --owner and manifest lines without one')
+parser.add_argument('--reserve', type=int, default=0, help='requests per token that are never used')
+parser.add_argument('--max-wait', type=float, default=None,
+                    help='longest wait in seconds for a rate limit before a download fails')
+args = parser.parse_args()
 
-app = application.Application(menu_width=100, data_dir='Temp_session_data/', token=None)
-app.run()
+data_dir = args.data_dir if args.data_dir.endswith('/') else args.data_dir + '/'
+app = application.Application(menu_width=100, data_dir=data_dir, token=None, reserve=args.reserve,
+                              max_wait=args.max_wait, max_repos=args.max_repos)
+if args.manifest is None and args.owner is None:
+    app.run()
+else:
+    # Excluded pull requests are dropped from the list pages, so they never cost a detail or profile request
+    pull_filter = gitdata.PullRequestFilter(authors=args.author, exclude_authors=args.exclude_author,
+                                            exclude_bots=args.exclude_bots, exclude_drafts=args.exclude_drafts,
+                                            labels=args.label, exclude_labels=args.exclude_label,
+                                            base_branches=args.base, states=[args.state] if args.state else None)
+    failures = list()
+    if args.manifest is not None:
+        failures += app.run_batch(args.manifest, max_repos=args.max_repos, default_time_window_days=args.days,
+                                  pull_filter=pull_filter, sample_size=args.sample_size)
+    if args.owner is not None:
+        failures += app.run_owner_crawl(args.owner, max_repos=args.max_repos, time_window_days=args.days,
+                                        include_forks=args.include_forks, include_archived=args.include_archived,
+                                        name_pattern=args.match, pull_filter=pull_filter,
+                                        sample_size=args.sample_size)
+    # Exit with an error code when a repository failed, so schedulers like cron can report it
+    sys.exit(1 if len(failures) > 0 else 0)
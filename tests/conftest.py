@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the top of the repository, next to this folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_github import FakeGitHub  # noqa: E402
+
+
+@pytest.fixture
+def fake_github():
+    fake = FakeGitHub()
+    fake.url = fake.start()
+    yield fake
+    fake.stop()
@@ -0,0 +1,185 @@
+import collections
+import datetime
+import json
+import re
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, urlencode
+
+
+# A small stand-in for the Github REST and GraphQL APIs, serving one repository of made up pull requests
+class FakeGitHub:
+    def __init__(self, n_pulls=250, hours_apart=7):
+        now = datetime.datetime.utcnow().replace(microsecond=0)
+        logins = ['alice', 'bob', 'carol', 'dave']
+        self.pulls = list()
+        for i in range(n_pulls):
+            number = n_pulls - i
+            created = now - datetime.timedelta(hours=i * hours_apart)
+            state = 'closed' if i % 3 else 'open'
+            self.pulls.append({
+                'number': number, 'title': f'PR {number}', 'body': 'body', 'state': state,
+                'created_at': created.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'updated_at': (created + datetime.timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'closed_at': None if state == 'open' else created.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'merged_at': None, 'draft': False, 'labels': [], 'base': {'ref': 'main'},
+                'user': {'login': logins[number % len(logins)], 'type': 'User'},
+                'additions': number * 3, 'deletions': number, 'changed_files': number % 9 + 1,
+                'commits': number % 4 + 1})
+        self.counts = collections.Counter()  # Requests per path, and 'POST pullRequests' for GraphQL pages
+        self.not_modified = 0  # 304 answers to revalidations
+        self.fail_paths = set()  # Paths answered with a server error
+        self.failures = collections.defaultdict(list)  # (status, headers) answers for a path before it works
+        self.revoked_tokens = set()  # Tokens answered with 401
+        self.search_limit = 1000  # Results a search query returns at most, like Github
+        self.tokens_used = collections.Counter()
+        self.remaining = 5000
+        self.lock = threading.Lock()
+        self.server = None
+
+    def start(self):
+        handler = type('Handler', (FakeGitHubHandler,), {'fake': self})
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def detail_requests(self):
+        return sum(count for path, count in self.counts.items() if re.fullmatch(r'/repos/o/r/pulls/\d+', path))
+
+
+class FakeGitHubHandler(BaseHTTPRequestHandler):
+    fake = None
+
+    def log_message(self, *args):
+        pass
+
+    def rejected(self):
+        token = self.headers.get('Authorization', '').replace('token ', '')
+        with self.fake.lock:
+            self.fake.tokens_used[token] += 1
+        if token in self.fake.revoked_tokens:
+            self.send(401, {'message': 'Bad credentials'})
+            return True
+        return False
+
+    def send(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        with self.fake.lock:
+            self.fake.remaining -= 1
+            remaining = self.fake.remaining
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('X-RateLimit-Limit', '5000')
+        self.send_header('X-RateLimit-Remaining', str(remaining))
+        self.send_header('X-RateLimit-Reset', str(int(datetime.datetime.now().timestamp()) + 3600))
+        for name, value in (headers or dict()).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def full_pull(self, pull):
+        host = f'http://{self.headers["Host"]}'
+        record = dict(pull)
+        record['url'] = f'{host}/repos/o/r/pulls/{pull["number"]}'
+        record['commits_url'] = record['url'] + '/commits'
+        record['diff_url'] = record['url'] + '.diff'
+        return record
+
+    def page(self, url, query, records):
+        # One page of records, with the Link header pointing to the next and last pages
+        per_page = int(query.get('per_page', 30))
+        page = int(query.get('page', 1))
+        last = max(1, -(-len(records) // per_page))
+        links = list()
+        if page < last:
+            base = f'http://{self.headers["Host"]}{url.path}?'
+            links.append(f'<{base}{urlencode(dict(query, page=page + 1))}>; rel="next"')
+            links.append(f'<{base}{urlencode(dict(query, page=last))}>; rel="last"')
+        return records[(page - 1) * per_page:page * per_page], {'Link': ', '.join(links)} if links else None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        with self.fake.lock:
+            self.fake.counts[url.path] += 1
+        if self.rejected():
+            return
+        if url.path in self.fake.fail_paths:
+            return self.send(500, {'message': 'Server error'})
+        with self.fake.lock:
+            failure = self.fake.failures[url.path].pop(0) if len(self.fake.failures[url.path]) > 0 else None
+        if failure is not None:
+            return self.send(failure[0], {'message': 'Try again'}, failure[1])
+
+        match = re.fullmatch(r'/users/([^/]+)', url.path)
+        if match:
+            # Profiles carry an ETag, a matching If-None-Match is answered with 304 and costs no budget
+            etag = f'"{match.group(1)}"'
+            if self.headers.get('If-None-Match') == etag:
+                with self.fake.lock:
+                    self.fake.not_modified += 1
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            return self.send(200, {'login': match.group(1), 'followers': 1, 'following': 2, 'public_repos': 3,
+                                   'public_gists': 4, 'type': 'User'}, {'ETag': etag})
+
+        if url.path == '/repos/o/r/pulls':
+            chunk, links = self.page(url, query, self.fake.pulls)
+            return self.send(200, [self.full_pull(pull) for pull in chunk], links)
+
+        if url.path == '/search/issues':
+            # Only the created:start..end qualifier is applied
+            start, end = re.search(r'created:(\S+)\.\.(\S+)', query['q']).groups()
+            found = [pull for pull in self.fake.pulls if start <= pull['created_at'] <= end]
+            chunk, links = self.page(url, query, found[:self.fake.search_limit])
+            items = list()
+            for pull in chunk:
+                record = self.full_pull(pull)
+                record['pull_request'] = {'url': record['url'], 'diff_url': record['diff_url'],
+                                          'merged_at': record['merged_at']}
+                items.append(record)
+            return self.send(200, {'total_count': len(found), 'incomplete_results': False, 'items': items}, links)
+
+        match = re.fullmatch(r'/repos/o/r/pulls/(\d+)', url.path)
+        if match:
+            for pull in self.fake.pulls:
+                if pull['number'] == int(match.group(1)):
+                    return self.send(200, self.full_pull(pull))
+        return self.send(404, {'message': 'Not Found'})
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        if self.rejected():
+            return
+        query = payload['query']
+        variables = payload.get('variables') or dict()
+        if 'pullRequests(' in query:
+            with self.fake.lock:
+                self.fake.counts['POST pullRequests'] += 1
+            start = int(variables['after']) if variables.get('after') else 0
+            end = start + variables.get('first', 100)
+            nodes = [{'number': pull['number'], 'title': pull['title'], 'body': pull['body'],
+                      'state': pull['state'].upper(), 'createdAt': pull['created_at'],
+                      'updatedAt': pull['updated_at'], 'closedAt': pull['closed_at'], 'mergedAt': pull['merged_at'],
+                      'isDraft': pull['draft'], 'baseRefName': 'main', 'labels': {'nodes': []},
+                      'author': {'login': pull['user']['login'], '__typename': 'User'},
+                      'additions': pull['additions'], 'deletions': pull['deletions'],
+                      'changedFiles': pull['changed_files'], 'commits': {'totalCount': pull['commits']}}
+                     for pull in self.fake.pulls[start:end]]
+            page_info = {'hasNextPage': end < len(self.fake.pulls), 'endCursor': str(end)}
+            return self.send(200, {'data': {'repository': {'pullRequests': {'pageInfo': page_info,
+                                                                            'nodes': nodes}}}})
+
+        # Batched profile lookups, aliased like u0: user(login: "alice") { ... }
+        users = {alias: {'login': login, 'followers': {'totalCount': 1}, 'following': {'totalCount': 2},
+                         'repositories': {'totalCount': 3}, 'gists': {'totalCount': 4}}
+                 for alias, login in re.findall(r'(\w+): user\(login: "([^"]+)"\)', query)}
+        return self.send(200, {'data': users})
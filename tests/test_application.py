@@ -0,0 +1,52 @@
+import time
+import types
+
+import application
+import gitdata
+
+
+def make_queue(fake_github, tmp_path):
+    # The queue only needs the session settings and somewhere to put the finished repositories
+    parent_app = types.SimpleNamespace(repos=list(), save_repository_files=lambda repo_data: None)
+    queue = application.DownloadQueue(parent_app, max_workers=2)
+    client = gitdata.GitHubClient(api_url=fake_github.url, pool_size=20,
+                                  rate_limiter=gitdata.RateLimiter(stop_event=queue.stop_event))
+    parent_app.repository_options = lambda: dict(client=client, output_filepath=str(tmp_path) + '/',
+                                                 user_cache=gitdata.ContributorCache())
+    return queue, client
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.05)
+    assert condition()
+
+
+def test_queued_repositories_are_downloaded_in_the_background(fake_github, tmp_path):
+    queue, client = make_queue(fake_github, tmp_path)
+    jobs = [queue.submit('o', 'r', None), queue.submit('o', 'r', 30)]
+
+    wait_for(lambda: len(queue.active_jobs()) == 0)
+    queue.stop()
+
+    assert [job.status for job in jobs] == ['done', 'done']
+    assert [len(repo.pull_requests) for repo in queue.app.repos] in ([250, 103], [103, 250])
+    assert 'repositories per minute' in queue.summary()
+
+
+def test_stopping_the_queue_ends_a_wait_for_the_rate_limit(fake_github, tmp_path):
+    queue, client = make_queue(fake_github, tmp_path)
+    # The budget is used up for the next hour, the download waits for the reset before its first request
+    client.rate_limiter.budgets[(None, 'core')] = {'limit': 5000, 'remaining': 0, 'reset': time.time() + 3600}
+    queue.max_workers = 1
+    running, waiting = queue.submit('o', 'r', None), queue.submit('o', 'r', 30)
+    wait_for(lambda: client.rate_limiter.seconds_waited > 0)
+
+    started = time.time()
+    queue.stop(timeout=10)
+
+    assert time.time() - started < 5
+    assert running.status == 'failed' and isinstance(running.error, InterruptedError)
+    assert waiting.status == 'queued'
+    assert fake_github.counts['/repos/o/r/pulls'] == 0
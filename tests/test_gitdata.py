@@ -0,0 +1,407 @@
+import json
+import os
+
+import pytest
+
+import gitdata
+
+
+def make_client(fake_github, **kwargs):
+    return gitdata.GitHubClient(api_url=fake_github.url, pool_size=20, **kwargs)
+
+
+def make_repository(fake_github, tmp_path, client=None, **kwargs):
+    if client is None:
+        client = make_client(fake_github)
+    options = dict(time_window_days=None, verbose=False, client=client, output_filepath=str(tmp_path) + '/',
+                   user_cache=gitdata.ContributorCache())
+    options.update(kwargs)
+    return gitdata.Repository('o', 'r', **options)
+
+
+def test_graphql_pages_until_the_time_window(fake_github, tmp_path):
+    # Pull requests are 7 hours apart, so 30 days cover the first 103 of them: two pages of 100
+    client = make_client(fake_github, token='token')
+    repo = make_repository(fake_github, tmp_path, client=client, engine='graphql', time_window_days=30)
+
+    assert len(repo.pull_requests) == 103
+    assert fake_github.counts['POST pullRequests'] == 2
+    assert [pull.number for pull in repo.pull_requests] == list(range(250, 147, -1))
+    assert repo.pull_requests[0].num_commits == 250 % 4 + 1
+    # Diff metrics came with the pages, not one REST request per pull request
+    assert fake_github.detail_requests() == 0
+
+
+def test_graphql_pages_everything_without_a_time_window(fake_github, tmp_path):
+    client = make_client(fake_github, token='token')
+    repo = make_repository(fake_github, tmp_path, client=client, engine='graphql')
+
+    assert len(repo.pull_requests) == 250
+    assert fake_github.counts['POST pullRequests'] == 3
+
+
+def test_a_small_sample_draws_at_least_two_from_every_group(fake_github, tmp_path):
+    # 250 pull requests 70 hours apart span 25 groups of state and month, too many for two draws each from 12
+    from fake_github import FakeGitHub
+    fake_github.pulls = FakeGitHub(hours_apart=70).pulls
+    repo = make_repository(fake_github, tmp_path, sample_size=12, sample_seed=1)
+
+    assert len(repo.get_sample_strata()) > 6
+    assert {key: len(indices) >= 2 for key, (size, indices) in repo.sample_strata.items()} == {('open',): True,
+                                                                                             ('closed',): True}
+    assert fake_github.detail_requests() == 12
+    estimates = repo.estimate_mean('num_commits', by='state')
+    assert list(estimates['n']) == [len(repo.sample_strata[(state,)][1]) for state in estimates.index]
+    assert (estimates['upper'] > estimates['lower']).all()
+
+
+def test_a_group_with_one_value_has_an_unknown_interval(fake_github, tmp_path):
+    repo = make_repository(fake_github, tmp_path, sample_size=12, sample_seed=1)
+    open_indices = repo.sample_strata[next(key for key in repo.sample_strata if key[0] == 'open')][1]
+    for index in open_indices[1:]:
+        repo.pull_requests.set_value('num_commits', index, None)
+
+    assert repo.estimate_mean('num_commits', by='state').loc['open', ['lower', 'upper']].isna().all()
+
+
+def test_allocate_sample_gives_every_stratum_its_minimum():
+    assert gitdata.allocate_sample(30, {'a': 100, 'b': 3, 'c': 1}, minimum=2) == {'a': 27, 'b': 2, 'c': 1}
+    assert gitdata.allocate_sample(10, {'a': 50, 'b': 50}) == {'a': 5, 'b': 5}
+    assert sum(gitdata.allocate_sample(1, {'a': 5, 'b': 5}, minimum=2).values()) == 1
+
+
+def test_a_stopped_download_drops_the_diff_metrics_not_started_yet(fake_github, tmp_path):
+    import threading
+    stop_event = threading.Event()
+    repo = make_repository(fake_github, tmp_path, lazy=True, stop_event=stop_event, max_workers=2)
+    stop_event.set()
+
+    with pytest.raises(InterruptedError):
+        repo.ensure_diff_metrics()
+    # Only the few downloads already running when the stop was noticed were made, not all 250
+    assert fake_github.detail_requests() < 20
+
+
+def test_only_the_current_pull_request_table_keeps_a_sidecar_file(fake_github, tmp_path):
+    text_dir = tmp_path / 'text'
+    text_dir.mkdir()
+    repo = make_repository(fake_github, tmp_path, text_mode='sidecar', text_dir=str(text_dir))
+
+    assert len(list(text_dir.iterdir())) == 1
+    assert repo.pull_requests[0].body == 'body'
+
+    repo.pull_requests = repo.make_pull_request_table(list(repo.pull_requests))
+    assert len(list(text_dir.iterdir())) == 1
+    assert repo.pull_requests[-1].body == 'body'
+
+    repo.pull_requests.close()
+    assert len(list(text_dir.iterdir())) == 0
+
+
+def test_profiles_from_the_last_sync_expire_with_the_cache_ttl(fake_github, tmp_path):
+    sync_dir = str(tmp_path / 'sync') + '/'
+
+    def profile_requests():
+        return sum(count for path, count in fake_github.counts.items() if path.startswith('/users/'))
+
+    make_repository(fake_github, tmp_path, sync_dir=sync_dir, user_cache=gitdata.ContributorCache(ttl_seconds=3600))
+    assert profile_requests() == 4
+
+    # A new session with an empty cache reuses the synced profiles while they are fresh
+    repo = make_repository(fake_github, tmp_path, sync_dir=sync_dir,
+                           user_cache=gitdata.ContributorCache(ttl_seconds=3600))
+    assert profile_requests() == 4
+    assert len(repo.users) == 4
+
+    sync_path = os.path.join(sync_dir, 'o-r.json')
+    with open(sync_path) as f:
+        sync_state = json.load(f)
+    for user in sync_state['users']:
+        user['downloaded_at'] -= 7200
+    with open(sync_path, 'w') as f:
+        json.dump(sync_state, f)
+
+    make_repository(fake_github, tmp_path, sync_dir=sync_dir, user_cache=gitdata.ContributorCache(ttl_seconds=3600))
+    assert profile_requests() == 8
+
+
+def test_a_late_response_does_not_raise_the_remaining_budget():
+    import types
+    limiter = gitdata.RateLimiter()
+
+    def record(remaining, reset):
+        limiter.record(types.SimpleNamespace(headers={'X-RateLimit-Limit': '5000', 'X-RateLimit-Reset': str(reset),
+                                                      'X-RateLimit-Remaining': str(remaining)}), 'core')
+        return limiter.budgets[(None, 'core')]['remaining']
+
+    assert record(90, 1000) == 90
+    # Sent before the previous one but answered after it, in the same window or the one before
+    assert record(95, 1000) == 90
+    assert record(4999, 900) == 90
+    # The budget was reset
+    assert record(4999, 4600) == 4999
+
+
+def test_a_revoked_token_is_dropped_from_the_pool(fake_github, tmp_path):
+    fake_github.revoked_tokens.add('bad')
+    client = make_client(fake_github, tokens=['good', 'bad'])
+    repo = make_repository(fake_github, tmp_path, client=client)
+
+    assert len(repo.pull_requests) == 250
+    assert repo.pull_requests_to_pandas()['num_commits'].notna().all()
+    assert len(repo.users) == 4
+    assert client.revoked_slots == {1}
+    assert client.n_tokens == 1
+    # Only the requests sent before the token was found out were rejected
+    assert fake_github.tokens_used['bad'] <= 16
+
+
+def test_a_failed_pull_request_keeps_the_order_of_the_rest(fake_github, tmp_path):
+    fake_github.fail_paths.add('/repos/o/r/pulls/200')
+    client = make_client(fake_github, rate_limiter=gitdata.RateLimiter(max_retries=0))
+    repo = make_repository(fake_github, tmp_path, client=client)
+
+    assert [pull.number for pull in repo.pull_requests] == list(range(250, 0, -1))
+    assert [pull.number for pull, e in repo.failed_pulls] == [200]
+    for pull in repo.pull_requests:
+        if pull.number == 200:
+            assert pull.num_commits is None
+        else:
+            assert pull.num_additions == pull.number * 3
+
+
+def test_cached_responses_are_revalidated(fake_github, tmp_path):
+    cache = gitdata.ResponseCache(cache_dir=str(tmp_path / 'http_cache') + '/')
+    client = make_client(fake_github, cache=cache)
+
+    first = client.get(fake_github.url + '/users/alice')
+    second = client.get(fake_github.url + '/users/alice')
+
+    assert first == second
+    assert fake_github.counts['/users/alice'] == 2
+    assert fake_github.not_modified == 1
+    assert cache.hits == 1
+    # The free revalidation doesn't lower the budget the client keeps track of
+    assert client.rate_limiter.state()['limits']['core']['remaining'] == fake_github.remaining
+
+
+def test_a_damaged_contributor_cache_is_ignored(tmp_path):
+    cache_path = tmp_path / 'users_cache.json'
+    cache_path.write_text('{"alice": {"downloaded_at": ')
+
+    cache = gitdata.ContributorCache(cache_path=str(cache_path), max_size=2)
+    cache.update({'alice': {'name': 'alice'}, 'bob': {'name': 'bob'}, 'carol': {'name': 'carol'}})
+    cache.save()
+
+    assert list(gitdata.ContributorCache(cache_path=str(cache_path), max_size=1).profiles) == ['carol']
+
+
+def test_concurrent_requests_for_the_same_url_are_shared(fake_github):
+    import concurrent.futures
+    import threading
+    client = make_client(fake_github)
+    barrier = threading.Barrier(8)
+
+    def get_profile(i):
+        barrier.wait()
+        return client.get(fake_github.url + '/users/bob')
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        profiles = list(executor.map(get_profile, range(8)))
+
+    assert all(profile == profiles[0] for profile in profiles)
+    assert fake_github.counts['/users/bob'] + client.rate_limiter.coalesced == 8
+
+
+def test_an_interrupted_download_resumes_from_its_checkpoint(fake_github, tmp_path):
+    checkpoint_dir = str(tmp_path / 'checkpoints') + '/'
+    client = make_client(fake_github)
+    iter_pages = client.iter_pages
+
+    def interrupted_pages(*args, **kwargs):
+        for i, page in enumerate(iter_pages(*args, **kwargs)):
+            if i == 1:
+                raise ConnectionError('Network dropped')
+            yield page
+
+    client.iter_pages = interrupted_pages
+    with pytest.raises(ConnectionError):
+        make_repository(fake_github, tmp_path, client=client, checkpoint_dir=checkpoint_dir)
+
+    checkpoint_path = os.path.join(checkpoint_dir, 'o-r.checkpoint.json')
+    with open(checkpoint_path) as f:
+        checkpoint = json.load(f)
+    assert checkpoint['pages_listed'] == 1
+    assert len(checkpoint['pull_requests']) == 100
+    assert all(record['num_commits'] is not None for record in checkpoint['pull_requests'])
+
+    # Only the pull requests the first attempt didn't get to are downloaded again
+    client.iter_pages = iter_pages
+    details_before = fake_github.detail_requests()
+    repo = make_repository(fake_github, tmp_path, client=client, checkpoint_dir=checkpoint_dir)
+
+    assert fake_github.detail_requests() - details_before == 150
+    assert sorted(pull.number for pull in repo.pull_requests) == list(range(1, 251))
+    assert repo.pull_requests_to_pandas()['num_commits'].notna().all()
+    # A finished download leaves nothing to resume
+    assert not os.path.exists(checkpoint_path)
+
+
+def test_a_damaged_checkpoint_starts_over(fake_github, tmp_path):
+    checkpoint_dir = tmp_path / 'checkpoints'
+    checkpoint_dir.mkdir()
+    (checkpoint_dir / 'o-r.checkpoint.json').write_text('{"key": ')
+
+    repo = make_repository(fake_github, tmp_path, checkpoint_dir=str(checkpoint_dir) + '/')
+
+    assert len(repo.pull_requests) == 250
+    assert fake_github.detail_requests() == 250
+
+
+def test_server_errors_and_throttling_are_retried(fake_github):
+    fake_github.failures['/users/alice'] = [(502, {}), (503, {}), (429, {'Retry-After': '0.3'})]
+    client = make_client(fake_github, rate_limiter=gitdata.RateLimiter(backoff_base=0.01))
+
+    assert client.get(fake_github.url + '/users/alice')['login'] == 'alice'
+    assert fake_github.counts['/users/alice'] == 4
+    assert client.rate_limiter.retries == 3
+    assert client.rate_limiter.seconds_waited >= 0.3
+
+
+def test_retries_give_up_after_max_retries(fake_github):
+    fake_github.failures['/users/alice'] = [(500, {})] * 3
+    client = make_client(fake_github, rate_limiter=gitdata.RateLimiter(backoff_base=0.01, max_retries=2))
+
+    with pytest.raises(ConnectionError):
+        client.get(fake_github.url + '/users/alice')
+    assert fake_github.counts['/users/alice'] == 3
+
+
+def test_a_low_budget_spreads_requests_until_the_reset():
+    import time
+    limiter = gitdata.RateLimiter(pace_below=0.1)
+    limiter.budgets[(None, 'core')] = {'limit': 100, 'remaining': 4, 'reset': time.time() + 0.8}
+
+    started = time.time()
+    for i in range(3):
+        limiter.finish('core', limiter.wait_for_budget('core'))
+
+    # Four requests left for 0.8 seconds are sent 0.2 seconds apart
+    assert 0.3 < time.time() - started < 0.8
+
+
+def test_an_empty_budget_waits_for_the_reset_or_gives_up():
+    import time
+    limiter = gitdata.RateLimiter(max_wait=0.5)
+    limiter.budgets[(None, 'core')] = {'limit': 100, 'remaining': 0, 'reset': time.time() + 60}
+
+    with pytest.raises(PermissionError):
+        limiter.wait_for_budget('core')
+    # The request that was never sent doesn't hold back any budget
+    assert limiter.in_flight[(None, 'core')] == 0
+
+
+def test_a_synced_repository_only_downloads_what_changed(fake_github, tmp_path):
+    import datetime
+    sync_dir = str(tmp_path / 'sync') + '/'
+    make_repository(fake_github, tmp_path, sync_dir=sync_dir)
+    assert fake_github.detail_requests() == 250
+
+    # One pull request is opened and the newest one is edited
+    later = (datetime.datetime.utcnow() + datetime.timedelta(hours=2)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    edited = dict(fake_github.pulls[0], title='Edited', updated_at=later)
+    opened = dict(edited, number=251, title='New', created_at=later, commits=9)
+    fake_github.pulls[:1] = [opened, edited]
+
+    repo = make_repository(fake_github, tmp_path, sync_dir=sync_dir)
+
+    assert fake_github.detail_requests() == 252
+    assert [pull.number for pull in repo.pull_requests][:3] == [251, 250, 249]
+    assert repo.pull_requests[0].num_commits == 9
+    assert repo.pull_requests[1].title == 'Edited'
+    assert len(repo.pull_requests) == 251
+
+
+def test_a_stored_repository_loads_without_the_network(fake_github, tmp_path):
+    store = gitdata.SessionStore(str(tmp_path / 'session.db'))
+    downloaded = make_repository(fake_github, tmp_path, store=store)
+    requests_made = sum(fake_github.counts.values())
+
+    loaded = make_repository(fake_github, tmp_path, store=store, engine='store')
+
+    assert sum(fake_github.counts.values()) == requests_made
+    assert store.list_repositories() == [{'owner_name': 'o', 'repo_name': 'r', 'time_window_days': None}]
+    assert loaded.pull_requests_to_json() == downloaded.pull_requests_to_json()
+    assert loaded.users_to_json() == downloaded.users_to_json()
+    store.close()
+
+
+def test_daily_tallies_count_every_event_per_day(fake_github, tmp_path):
+    import collections
+    import matplotlib
+    matplotlib.use('Agg')
+    for pull in fake_github.pulls[::5]:
+        pull['merged_at'] = pull['closed_at']
+    repo = make_repository(fake_github, tmp_path)
+    other = make_repository(fake_github, tmp_path, time_window_days=30)
+
+    analysis = gitdata.AllRepositories([repo, other], output_filepath=str(tmp_path))
+
+    expected = collections.Counter()
+    for pull in list(repo.pull_requests) + list(other.pull_requests):
+        for event, timestamp in (('opened', pull.created_at), ('closed', pull.closed_at), ('merged', pull.merged_at)):
+            if timestamp is not None:
+                expected[(timestamp[:10], event)] += 1
+    tallies = analysis.daily_tallies
+    assert len(tallies) == (analysis.end_date - analysis.start_date).days + 1
+    assert {(str(date.date()), event): count for (date, event), count in tallies.stack().items()
+            if count > 0} == dict(expected)
+    assert analysis.daily_tallies_by_repo[('opened', 'o/r')].sum() == 250 + 103
+
+
+def test_a_search_with_too_many_results_is_split_in_ranges(fake_github, tmp_path, monkeypatch):
+    monkeypatch.setattr(gitdata, 'SEARCH_RESULTS_LIMIT', 100)
+    fake_github.search_limit = 100
+
+    repo = make_repository(fake_github, tmp_path, engine='search', time_window_days=60)
+
+    # Pull requests are 7 hours apart, so 60 days cover the first 206 of them
+    assert [pull.number for pull in repo.pull_requests] == list(range(250, 44, -1))
+    assert fake_github.counts['/search/issues'] > 3
+    assert fake_github.detail_requests() == 206
+    assert fake_github.counts['/repos/o/r/pulls'] == 0
+
+
+def test_filtered_out_pull_requests_are_never_downloaded(fake_github, tmp_path):
+    fake_github.pulls[0]['user'] = {'login': 'renovate[bot]', 'type': 'Bot'}
+    fake_github.pulls[1]['draft'] = True
+    store = gitdata.SessionStore(str(tmp_path / 'session.db'))
+    make_repository(fake_github, tmp_path, store=store)
+    requests_before = fake_github.detail_requests()
+
+    pull_filter = gitdata.PullRequestFilter(exclude_authors=['alice'], exclude_bots=True, exclude_drafts=True)
+    repo = make_repository(fake_github, tmp_path, store=store, pull_filter=pull_filter,
+                           user_cache=gitdata.ContributorCache())
+
+    kept = [pull['number'] for pull in fake_github.pulls[2:] if pull['user']['login'] != 'alice']
+    assert [pull.number for pull in repo.pull_requests] == kept
+    assert fake_github.detail_requests() - requests_before == len(kept)
+    assert fake_github.counts['/users/alice'] == 1
+    assert sorted(user.name for user in repo.users) == ['bob', 'carol', 'dave']
+    # A filtered download is incomplete and leaves the stored full download alone
+    assert len(store.load_pull_requests('o', 'r')) == 250
+    store.close()
+
+
+def test_a_filter_turns_into_search_qualifiers():
+    pull_filter = gitdata.PullRequestFilter(authors=['bob'], exclude_authors=['eve'], exclude_drafts=True,
+                                            labels=['good first issue', 'bug'], states=['open'])
+
+    assert pull_filter.search_qualifiers() == ('is:open author:bob -author:eve draft:false '
+                                               'label:bug,"good first issue"')
+    assert pull_filter.rest_params() == {'state': 'open'}
+    assert pull_filter.matches({'user': 'bob', 'is_bot': False, 'draft': False, 'labels': ['bug'], 'base': 'main',
+                                'state': 'open'})
+    assert not pull_filter.matches({'user': 'bob', 'is_bot': False, 'draft': False, 'labels': ['docs'],
+                                    'base': 'main', 'state': 'open'})
+    assert not gitdata.PullRequestFilter().active